@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+"""
+Binary archive of decoded AIS messages.
+
+Each message is stored as a fixed size record holding its receive time,
+message id, MMSI and packed message bits, so an archive is read back
+without parsing NMEA text. With 21 byte payloads, a position report takes
+36 bytes, against about 50 for its NMEA sentence alone. The default payload
+size holds every supported type, but its 68 byte records are larger than
+the sentences of position reports:
+
+    with AISArchiveWriter("feed.ais") as archive:
+        for aismsg in aislib.decode_stream(f, skip_invalid=True):
+            archive.write(aismsg)
+
+    with AISArchive("feed.ais") as archive:
+        for received, aismsg in archive.query(mmsi=237772000, start=t0, end=t1):
+            ...
+
+This program is licensed under the GNU GENERAL PUBLIC LICENSE Version 2.
+A LICENSE file should have accompanied this program.
+"""
+
+import bisect
+import mmap
+import struct
+import time
+
+import aislib
+
+
+# File header: magic, format version and record payload size in bytes
+MAGIC = b"AISARC"
+VERSION = 1
+_header = struct.Struct("<6sBxH6x")
+
+# Record: receive time, message id, mmsi, number of message bits, followed
+# by the message bits, big endian, in a payload of fixed size
+_record = struct.Struct("<dBIH")
+
+# Offset of the message id in a record
+_msgid_offset = struct.calcsize("<d")
+
+# Longest message of the supported types, in bytes
+MAX_PAYLOAD = 53
+
+
+
+class AISArchiveWriter(object):
+
+    """
+    Appends messages to an archive file, created if it does not exist.
+
+    All records of a file have the same payload size, so any record is found
+    by its number. The default holds any supported message, giving 68 byte
+    records, larger than the NMEA sentence of a position report. Archives of
+    position reports only can use 21 bytes (168 bits) for 36 byte records.
+    """
+
+    def __init__(self, path, payload_bytes = MAX_PAYLOAD):
+        self._file = open(path, "ab+")
+        self._file.seek(0, 2)
+
+        if self._file.tell():
+            self._file.seek(0)
+            payload_bytes = _read_header(self._file.read(_header.size))
+            self._file.seek(0, 2)
+        else:
+            self._file.write(_header.pack(MAGIC, VERSION, payload_bytes))
+
+        self.payload_bytes = payload_bytes
+        self._struct = struct.Struct(_record.format + "%ds" % payload_bytes)
+
+
+    def write(self, aismsg, received = None):
+        """
+        Appends a message to the archive
+
+        @param  aismsg      An instance of AISMessage
+        @param  received    Receive time, in seconds since the epoch. Defaults
+                            to now
+        """
+        length = aismsg._layout.length
+
+        if length > self.payload_bytes * 8:
+            raise ValueError("Message of %d bits does not fit in %d byte records." % (length, self.payload_bytes))
+
+        if received is None:
+            received = time.time()
+
+        self._file.write(self._struct.pack(received, aismsg.id, aismsg.mmsi, length,
+                                           aismsg.pack().to_bytes(self.payload_bytes, "big")))
+
+
+    def flush(self):
+        self._file.flush()
+
+
+    def close(self):
+        self._file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+class AISArchive(object):
+
+    """
+    Memory mapped reader of an archive file. Records are only unpacked and
+    decoded when they are returned, so a query only pays for its matches.
+    Queries by message type read the id from the record header.
+
+    Indexes by MMSI and by time are built on the first query which needs
+    them, from a scan of the record headers. Records written after the
+    archive was opened are not seen.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.payload_bytes = _read_header(f.read(_header.size))
+            f.seek(0, 2)
+            size = f.tell()
+            self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        self.record_size = _record.size + self.payload_bytes
+        self._count = (size - _header.size) // self.record_size
+
+        # mmsi -> ([receive times], [record numbers]), in time order
+        self._by_mmsi = None
+
+        # ([receive times], [record numbers]), in time order
+        self._by_time = None
+
+
+    def __len__(self):
+        return self._count
+
+
+    def __getitem__(self, i):
+        """
+        Returns the (receive time, AISMessage) of record i
+        """
+        if i < 0:
+            i += self._count
+
+        if not 0 <= i < self._count:
+            raise IndexError("Record index out of range.")
+
+        offset = _header.size + i * self.record_size
+        received, msgid, mmsi, length = _record.unpack_from(self._map, offset)
+        value = int.from_bytes(self._map[offset + _record.size:offset + self.record_size], "big")
+
+        return received, aislib.decode_bits(value, length)
+
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+
+    def headers(self):
+        """
+        Generator of the (receive time, message id, mmsi) of all records, in
+        file order, without decoding them
+        """
+        data = self._map
+        unpack = _record.unpack_from
+
+        # Records are unpacked from the map by offset, a memoryview held by
+        # the generator would stop close() from unmapping the file
+        for offset in range(_header.size, _header.size + self._count * self.record_size, self.record_size):
+            received, msgid, mmsi, length = unpack(data, offset)
+            yield received, msgid, mmsi
+
+
+    def query(self, mmsi = None, start = None, end = None, types = None):
+        """
+        Generator of the (receive time, AISMessage) of the records matching
+        all given criteria, in receive time order
+
+        @param  mmsi    Only messages of this MMSI
+        @param  start   Only messages received at or after this time
+        @param  end     Only messages received before this time
+        @param  types   Optional collection of message ids
+        """
+        if mmsi is not None:
+            times, records = self._index_mmsi().get(mmsi, ((), ()))
+        else:
+            times, records = self._index_time()
+
+        lo = 0 if start is None else bisect.bisect_left(times, start)
+        hi = len(times) if end is None else bisect.bisect_left(times, end)
+
+        if types is None:
+            for i in range(lo, hi):
+                yield self[records[i]]
+            return
+
+        # The message id is read from the record header, so records of other
+        # types are skipped without being decoded
+        data = self._map
+        first, size = _header.size + _msgid_offset, self.record_size
+
+        for i in range(lo, hi):
+            if data[first + records[i] * size] in types:
+                yield self[records[i]]
+
+
+    def mmsis(self):
+        """
+        Returns the set of MMSIs in the archive
+        """
+        return set(self._index_mmsi())
+
+
+    def _index_mmsi(self):
+        if self._by_mmsi is None:
+            entries = {}
+
+            for i, (received, msgid, mmsi) in enumerate(self.headers()):
+                entries.setdefault(mmsi, []).append((received, i))
+
+            self._by_mmsi = dict((mmsi, _split(sorted(pairs))) for mmsi, pairs in entries.items())
+
+        return self._by_mmsi
+
+
+    def _index_time(self):
+        if self._by_time is None:
+            self._by_time = _split(sorted((received, i) for i, (received, msgid, mmsi) in enumerate(self.headers())))
+
+        return self._by_time
+
+
+    def close(self):
+        self._map.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+def _read_header(data):
+
+    """
+    Returns the record payload size of an archive file header
+    """
+
+    if len(data) < _header.size:
+        raise ValueError("Not an AIS archive.")
+
+    magic, version, payload_bytes = _header.unpack(data)
+
+    if magic != MAGIC:
+        raise ValueError("Not an AIS archive.")
+
+    if version != VERSION:
+        raise ValueError("Unsupported AIS archive version %d." % version)
+
+    return payload_bytes
+
+
+def _split(pairs):
+    return [p[0] for p in pairs], [p[1] for p in pairs]
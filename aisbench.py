@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+"""
+Encode and decode benchmarks of aislib, per message type.
+
+Measures the throughput, in messages per second, and the memory allocated
+per message of encoding, decoding and round tripping each supported message
+type. Position reports are taken from the highspeed4.txt track, other types
+from corpora generated with a fixed seed, so runs are reproducible. Results
+are written as JSON and can be compared with those of an earlier run:
+
+    python aisbench.py --output before.json
+    ... upgrade ...
+    python aisbench.py --output after.json --compare before.json
+
+This program is licensed under the GNU GENERAL PUBLIC LICENSE Version 2.
+A LICENSE file should have accompanied this program.
+"""
+
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import aislib
+import aisplay
+
+
+# Benchmarked message types: name -> (class, fixed element values)
+corpora = [
+    ("1/2/3", aislib.AISPositionReportMessage,                      {}),
+    ("5",     aislib.AISStaticAndVoyageReportMessage,               {'id': 5}),
+    ("8",     aislib.AISBinaryBroadcastMessageAreaNoticeCircle,     {'id': 8}),
+    ("21",    aislib.AISAtonReport,                                 {'id': 21}),
+    ("24A",   aislib.AISStaticDataReportAMessage,                   {'id': 24, 'partno': 0}),
+    ("24B",   aislib.AISStaticDataReportBMessage,                   {'id': 24, 'partno': 1})
+]
+
+
+def generate(aisclass, fixed, count, seed = 0):
+
+    """
+    Returns a list of count messages of the given class, with random element
+    values and the given fixed ones
+    """
+
+    rng = random.Random(seed)
+    length = aisclass._layout.length
+    messages = []
+
+    for i in range(count):
+        aismsg = aisclass.from_bits(rng.getrandbits(length), length)
+
+        for name, value in fixed.items():
+            setattr(aismsg, name, value)
+
+        messages.append(aismsg)
+
+    return messages
+
+
+def track_reports(path, count, seed = 0):
+
+    """
+    Returns a list of count position reports of types 1, 2 and 3 replaying the
+    given track at its ITU reporting intervals
+    """
+
+    rng = random.Random(seed)
+    track = aisplay.load_track(path, 239658000)
+    playback = aisplay.AISPlayback(itu_intervals = True)
+    messages = []
+
+    while len(messages) < count:
+        playback.add(track)
+
+        for t, sentence in playback.events():
+            aismsg = aislib.decode(sentence)
+            aismsg.id = rng.choice((1, 2, 3))
+            messages.append(aismsg)
+
+            if len(messages) == count:
+                break
+
+    return messages
+
+
+def encode(messages):
+    return [aislib.AIS(aismsg).build_sentences() for aismsg in messages]
+
+
+def decode(sentences):
+    add = aislib.AISReassembler().add
+    return [add(sentence) for group in sentences for sentence in group]
+
+
+def roundtrip(messages):
+    return decode(encode(messages))
+
+
+def timeit(func, data, repeat):
+
+    """
+    Returns the best time in seconds of repeat runs of func(data)
+    """
+
+    best = None
+
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func(data)
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def allocations(func, data):
+
+    """
+    Returns the (blocks, bytes) allocated per message by func(data), while
+    its result is alive, and the peak bytes per message during the run
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    result = func(data)
+    blocks = sys.getallocatedblocks() - blocks
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    return float(blocks) / len(data), float(size) / len(data), float(peak) / len(data)
+
+
+def run(count = 10000, repeat = 5, track = "highspeed4.txt", seed = 0):
+
+    """
+    Runs the benchmarks and returns the results as a dict
+    """
+
+    results = []
+
+    for name, aisclass, fixed in corpora:
+        if name == "1/2/3":
+            messages = track_reports(track, count, seed)
+        else:
+            messages = generate(aisclass, fixed, count, seed)
+
+        sentences = encode(messages)
+
+        for operation, func, data in (("encode", encode, messages),
+                                      ("decode", decode, sentences),
+                                      ("roundtrip", roundtrip, messages)):
+            seconds = timeit(func, data, repeat)
+            blocks, size, peak = allocations(func, data)
+
+            results.append({
+                'type'                  : name,
+                'operation'             : operation,
+                'messages'              : count,
+                'seconds'               : seconds,
+                'messages_per_second'   : count / seconds,
+                'blocks_per_message'    : blocks,
+                'bytes_per_message'     : size,
+                'peak_bytes_per_message': peak
+            })
+
+    return {
+        'python'    : platform.python_version(),
+        'platform'  : platform.platform(),
+        'numpy'     : aislib.numpy is not None,
+        'time'      : time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'count'     : count,
+        'repeat'    : repeat,
+        'seed'      : seed,
+        'results'   : results
+    }
+
+
+def compare(before, after):
+
+    """
+    Returns the list of (type, operation, before, after, change) of the
+    throughputs of two runs, change being the relative difference
+    """
+
+    old = dict(((r['type'], r['operation']), r['messages_per_second']) for r in before['results'])
+    rows = []
+
+    for r in after['results']:
+        key = (r['type'], r['operation'])
+
+        if key in old:
+            new = r['messages_per_second']
+            rows.append(key + (old[key], new, new / old[key] - 1))
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmarks aislib encoding and decoding per message type.")
+    parser.add_argument("--count", type = int, default = 10000, help = "messages per corpus")
+    parser.add_argument("--repeat", type = int, default = 5, help = "runs per benchmark, the best is kept")
+    parser.add_argument("--track", default = "highspeed4.txt", help = "track file of the position reports")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--output", help = "file to write the JSON results to")
+    parser.add_argument("--compare", help = "JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    report = run(args.count, args.repeat, args.track, args.seed)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 2)
+
+    for r in report['results']:
+        print("%-6s %-10s %10.0f msg/s %6.1f blocks/msg %8.1f bytes/msg" % (
+            r['type'], r['operation'], r['messages_per_second'], r['blocks_per_message'], r['bytes_per_message']))
+
+    if args.compare:
+        with open(args.compare) as f:
+            before = json.load(f)
+
+        print("")
+
+        for name, operation, old, new, change in compare(before, report):
+            print("%-6s %-10s %10.0f -> %10.0f msg/s %+6.1f%%" % (name, operation, old, new, change * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""
+Bulk export of decoded AIS messages as JSON lines or CSV.
+
+Both writers stream any iterable of messages, such as decode_stream() or an
+archive query, to an open text file. The column order of each message type
+is worked out once, and rows are written in batches:
+
+    with open("day.jsonl", "w") as f:
+        write_jsonl(aislib.decode_stream(feed, skip_invalid=True), f)
+
+    with open("day.csv", "w", newline="") as f:
+        write_csv(aislib.decode_stream(feed, skip_invalid=True), f)
+
+Elements holding 6-bit text, such as ship names, are written as strings.
+
+This program is licensed under the GNU GENERAL PUBLIC LICENSE Version 2.
+A LICENSE file should have accompanied this program.
+"""
+
+import csv
+import json
+import operator
+
+import aislib
+
+
+# Message classes, in the order their columns appear in CSV files
+message_classes = [
+    aislib.AISPositionReportMessage,
+    aislib.AISStaticAndVoyageReportMessage,
+    aislib.AISBinaryBroadcastMessageAreaNoticeCircle,
+    aislib.AISAtonReport,
+    aislib.AISStaticDataReportAMessage,
+    aislib.AISStaticDataReportBMessage
+]
+
+
+def _base(aismsg):
+    # Lazily decoded messages are instances of a sub-class of their class
+    cls = type(aismsg)
+    return getattr(cls, '_base', cls)
+
+
+def write_jsonl(messages, f, batch_size = 1000):
+
+    """
+    Writes messages as JSON objects, one per line
+
+    @param  messages    Iterable of AISMessage instances
+    @param  f           Text file open for writing
+    @param  batch_size  Number of lines written at once
+    @return             Number of messages written
+    """
+
+    # class -> (line template, text column indexes)
+    templates = {}
+    batch = []
+    count = 0
+
+    for aismsg in messages:
+        cls = _base(aismsg)
+        entry = templates.get(cls)
+
+        if entry is None:
+            layout = cls._layout
+            text = [i for i, nchars in layout.text_columns]
+            template = "{%s}\n" % ", ".join("%s: %s" % (json.dumps(name), "%s" if i in text else "%d")
+                                            for i, name in enumerate(layout.names))
+            entry = templates[cls] = (template, text)
+
+        template, text = entry
+        values = aismsg.as_tuple(text = True)
+
+        if text:
+            values = list(values)
+
+            for i in text:
+                values[i] = json.dumps(values[i])
+
+            values = tuple(values)
+
+        batch.append(template % values)
+        count += 1
+
+        if len(batch) >= batch_size:
+            f.write("".join(batch))
+            batch = []
+
+    if batch:
+        f.write("".join(batch))
+
+    return count
+
+
+def csv_columns(classes = None):
+
+    """
+    Returns the CSV column names of the given message classes: their element
+    names, each name once, in the order of the classes
+    """
+
+    columns = []
+
+    for cls in classes or message_classes:
+        for name in cls._layout.names:
+            if name not in columns:
+                columns.append(name)
+
+    return columns
+
+
+def write_csv(messages, f, columns = None, header = True, batch_size = 1000):
+
+    """
+    Writes messages as CSV rows. Each message fills the columns of its
+    elements, the other columns are left empty.
+
+    @param  messages    Iterable of AISMessage instances
+    @param  f           Text file open for writing, with newline=''
+    @param  columns     Column names, defaults to csv_columns(). Elements
+                        without a column are not written
+    @param  header      Write the column names as the first row
+    @param  batch_size  Number of rows written at once
+    @return             Number of messages written
+    """
+
+    if columns is None:
+        columns = csv_columns()
+
+    writer = csv.writer(f)
+
+    if header:
+        writer.writerow(columns)
+
+    # class -> function picking the row out of the element values followed
+    # by an empty string, for the columns the class does not have
+    getters = {}
+    batch = []
+    count = 0
+
+    for aismsg in messages:
+        cls = _base(aismsg)
+        getter = getters.get(cls)
+
+        if getter is None:
+            names = cls._layout.names
+            empty = len(names)
+            indexes = [names.index(c) if c in names else empty for c in columns]
+            getter = getters[cls] = operator.itemgetter(*indexes) if len(indexes) > 1 \
+                                    else lambda values: (values[indexes[0]],)
+
+        batch.append(getter(aismsg.as_tuple(text = True) + ("",)))
+        count += 1
+
+        if len(batch) >= batch_size:
+            writer.writerows(batch)
+            batch = []
+
+    if batch:
+        writer.writerows(batch)
+
+    return count
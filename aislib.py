@@ -21,6 +21,19 @@ from builtins import object
 
 import bitstring
 import binascii
+import bisect
+import collections
+import functools
+import itertools
+import mmap
+import multiprocessing
+import operator
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
     
 # Create a character encoding and reversed character encoding map which
@@ -54,6 +67,41 @@ def AISString2Bits(name,length=20):
     return bitstring.Bits().join(['uint:6=%d' % re_AISchars[name[k]] for k in range(len(name))])
 
 
+@functools.lru_cache(maxsize = 4096)
+def AISString2Int(name, length = 20):
+    """
+    Returns the 6-bit ascii encoding of the given text as a signed integer of
+    length characters, the value AISString2Bits(name, length).int gives. The
+    results are memoized, names, callsigns and destinations repeat a lot
+    """
+    if len(name)>length: name = name[:length]
+    if len(name)<length: name = name+'@'*(length-len(name))
+
+    value = 0
+
+    for c in name:
+        value = (value << 6) | re_AISchars[c]
+
+    sign = 1 << (6 * length - 1)
+
+    return (value ^ sign) - sign
+
+
+@functools.lru_cache(maxsize = 4096)
+def AISInt2String(value, length = 20):
+    """
+    Returns the text of length 6-bit ascii characters held in the given
+    integer, as returned by AISString2Int(), without the trailing '@'
+    padding and spaces
+    """
+    chars = []
+
+    for i in range(length - 1, -1, -1):
+        chars.append(AISchars[(value >> (6 * i)) & 0x3f])
+
+    return "".join(chars).rstrip("@ ")
+
+
 def int2bin6(num):
     """
     Converts the given integer to a 6-bit binary representation
@@ -63,65 +111,254 @@ def int2bin6(num):
 
 
 
+def armor(value, length):
+    """
+    Encodes the integer holding length message bits into the 6-bit ascii
+    armored payload, followed by a comma and the number of fill bits. The
+    message bits are padded with zeros at the end up to a 6-bit boundary.
+    """
+
+    fillbits = -length % 6
+    value <<= fillbits
+    shift = length + fillbits
+
+    chars = []
+
+    while shift:
+        shift -= 6
+        chars.append(encodingchars[(value >> shift) & 0x3f])
+
+    return "".join(chars) + ',' + chr(ord('0') + fillbits)
+
+
+
+# Translation table turning each armored payload character into the two octal
+# digits of its 6-bit value, so that a whole payload is de-armored by a single
+# str.translate() and int() call instead of a loop in Python
+_dearmor_table = dict((ord(c), '%02o' % i) for i, c in enumerate(encodingchars))
+
+
+def dearmor(payload, fillbits = 0):
+    """
+    Decodes a 6-bit ascii armored payload into the integer holding its
+    message bits.
+
+    @param  payload     The armored payload (field 6 of the sentence), as a
+                        string or a bytes-like object
+    @param  fillbits    Number of fill bits padding the end of the payload
+    @return             Tuple (value, length), length being the number of bits
+    """
+
+    if not payload:
+        return 0, 0
+
+    # bytes.translate() maps each byte to a single byte, so bytes payloads are
+    # expanded to octal digits through str
+    if not isinstance(payload, str):
+        payload = bytes(payload).decode("latin-1")
+
+    digits = payload.translate(_dearmor_table)
+
+    # Characters outside the armoring alphabet are left untranslated
+    if len(digits) != 2 * len(payload):
+        raise ValueError("Invalid character in AIS payload.")
+
+    return int(digits, 8) >> fillbits, 6 * len(payload) - fillbits
+
+
+
 class CRCInvalidError(Exception):
     pass
 
 
 
-class AISMessage(object):
+class UnsupportedMessageError(Exception):
+    pass
 
-    # Contain our AIS message elements
-    _attrs = {}
-    
-    # Map the number of bits for each element in the AIS message
-    _bitmap = {}
 
-    
-    def __init__(self, elements):
-        # Init our bit mapping and load up default message values
-        for key, arr in elements.items():
-            # arr[0] == data type of the element
-            # arr[1] == number of bits for given element
-            # arr[2] == the default value for the element
-            self._bitmap[key] = [ arr[0], arr[1] ]
-            # Set default value
-            self.__setattr__(key, arr[2])
 
-            
-    def __getattr__(self, name):
+class FragmentError(Exception):
+    pass
+
+
+
+class AISLayout(object):
+    """
+    Declarative bit layout of an AIS message type.
+
+    A layout is a list of (element, data_type, num_bits) tuples in transmission
+    order. It is compiled once, when the message class is defined, into a table
+    of shifts and masks so that a whole message can be packed into, or unpacked
+    from, a single Python integer without going through bitstring.
+
+    'text' lists the elements holding 6-bit ascii text, such as names.
+    """
+
+    def __init__(self, fields, text = ()):
+        self.fields = tuple(fields)
+        self.names = tuple(f[0] for f in self.fields)
+        self.length = sum(f[2] for f in self.fields)
+        self.text = tuple(text)
+
+        # Returns the tuple of all element values of a message, in one call
+        self.values = operator.attrgetter(*self.names)
+
+        # (index, number of characters) of the text elements in self.names
+        self.text_columns = tuple((self.names.index(name), self.fields[self.names.index(name)][2] // 6)
+                                  for name in self.text)
+
+        # Maps element name -> [data_type, num_bits]
+        self.bitmap = {}
+
+        # Compiled (name, shift, mask, sign_bit) entries, one per element.
+        # sign_bit is 0 for unsigned elements.
+        specs = []
+        shift = self.length
+
+        for name, dtype, nbits in self.fields:
+            shift -= nbits
+            self.bitmap[name] = [dtype, nbits]
+            specs.append((name, shift, (1 << nbits) - 1,
+                          (1 << (nbits - 1)) if dtype == "int" else 0))
+
+        self._specs = tuple(specs)
+
+        # Generate straight-line pack/unpack functions for this layout, so
+        # the per element loop is only paid once, here, and not per message
+        pack_terms = []
+        range_terms = []
+        unpack_terms = []
+        unpack_lines = []
+
+        for name, shift, mask, sign in self._specs:
+            pack_terms.append("((o.%s & %d) << %d)" % (name, mask, shift))
+
+            if sign:
+                range_terms.append("%d <= o.%s < %d" % (-sign, name, sign))
+            else:
+                range_terms.append("0 <= o.%s <= %d" % (name, mask))
+
+            if sign:
+                term = "(((x >> %d) & %d) ^ %d) - %d" % (shift, mask, sign, sign)
+            else:
+                term = "(x >> %d) & %d" % (shift, mask)
+
+            unpack_terms.append("%r: %s" % (name, term))
+            unpack_lines.append("    o.%s = %s\n" % (name, term))
+
+        code = ("def pack(o):\n    return %s\n"
+                "def in_range(o):\n    return %s\n"
+                "def unpack(x):\n    return {%s}\n"
+                "def unpack_into(o, x):\n%s    return o\n"
+                % (" | ".join(pack_terms) or "0", " and ".join(range_terms) or "True",
+                   ", ".join(unpack_terms), "".join(unpack_lines)))
+        namespace = {}
+        exec(compile(code, "<AISLayout>", "exec"), namespace)
+
+        self._pack = namespace["pack"]
+        self._in_range = namespace["in_range"]
+        self._unpack = namespace["unpack"]
+        self._unpack_into = namespace["unpack_into"]
+
+
+    def pack(self, message):
         """
-        We are overriding the behavior of __getattr__ to implement dynamic class
-        properties. This way we can do stuff like [class].[property] without
-        requiring a "getter" method for each property.
-        
-        If the AIS message element is not found in our attribute table, we'll
-        revert to the default behavior of __getattr__
+        Pack the element values of a message into one integer holding the
+        message bits, first element in the most significant bits. Raises
+        TypeError or ValueError, see check(), if a value does not fit in its
+        element.
+
+        @param  message Object holding the element values as attributes
+        @return         Integer of self.length bits
         """
-        
-        if name in self._attrs:
-            return self._attrs[name]
-        
-        # Preserve the default behavior if our custom attributes were not found
-        return super(AISMessage, self).__getattr__(name)
+        try:
+            if self._in_range(message):
+                return self._pack(message)
+        except TypeError:
+            pass
 
+        # Find the offending element. Values in range but of the wrong type,
+        # such as floats, only fail in _pack()
+        for name in self.names:
+            self.check(name, getattr(message, name))
 
-    def __setattr__(self, name, value):
+        return self._pack(message)
+
+
+    def _fit(self, value, length):
+        """
+        Zero pads short messages and drops the extra trailing bits of long ones
+        """
+        if length is not None and length != self.length:
+            if length < self.length:
+                value <<= self.length - length
+            else:
+                value >>= length - self.length
+
+        return value
+
+
+    def unpack(self, value, length = None):
+        """
+        Unpack an integer holding the message bits into a dict of element values.
+
+        @param  value   Integer holding the message bits
+        @param  length  Number of bits held in value. Short messages are zero
+                        padded, extra trailing bits are ignored
+        @return         Dict of element name to integer value
+        """
+        return self._unpack(self._fit(value, length))
+
+
+    def unpack_into(self, message, value, length = None):
+        """
+        Unpack an integer holding the message bits into the attributes of
+        message. See unpack()
+        """
+        return self._unpack_into(message, self._fit(value, length))
+
+
+    def check(self, name, value):
         """
-        We are overriding the __setattr__ to implement dynamic property "setters".
+        Raises TypeError if value is not an integer and ValueError if it does
+        not fit in the given element
         """
         if type(value) not in [ int,int]:
             raise TypeError("Value must be an integer.")
-            
-        if name == "_bitmap":
-            super(AISMessage, self).__setattr__(name, value)
-            
-        # Set attributes that are supported by the sub-classed AIS message type
-        elif name in self._bitmap:
-            # String format is: [datatype]:[num_bits]=[value]
-            self._attrs[name] = bitstring.Bits(
-                    "%s:%d=%d" % (self._bitmap[name][0], self._bitmap[name][1], value))
+
+        dtype, nbits = self.bitmap[name]
+
+        if dtype == "int":
+            lo, hi = -(1 << (nbits - 1)), (1 << (nbits - 1)) - 1
         else:
-            raise AttributeError("Unsupported AIS message element.")
+            lo, hi = 0, (1 << nbits) - 1
+
+        if not lo <= value <= hi:
+            raise ValueError("Value %d out of range for %s:%d element '%s'."
+                             % (value, dtype, nbits, name))
+
+
+
+class AISMessage(object):
+
+    # Element values are plain integers held in slots. Sub-classes list the
+    # element names of their layout in __slots__. '_lazy' holds the
+    # (payload, fillbits) of a lazily decoded message until it is unpacked
+    __slots__ = ('_lazy',)
+
+    # Compiled AISLayout of the message, sub-classes must define this
+    _layout = None
+
+    
+    def __init__(self, elements):
+        # Load up the message values, elements maps element name -> value.
+        # Values are checked here, elements assigned later are checked when
+        # the message is packed
+        layout = self._layout
+
+        for key in layout.names:
+            layout.check(key, elements[key])
+            setattr(self, key, elements[key])
 
 
     def get_attr(self, name):
@@ -132,47 +369,179 @@ class AISMessage(object):
         @param  name    Name of the AIS message element to retrieve
         @return         Human readable int value. If invalid element, returns None
         """
-        if name in self._attrs:
-            if self._bitmap[name][0] == "int":
-                return self._attrs[name].int
-            else:
-                return self._attrs[name].uint
+        if name in self._layout.bitmap:
+            return getattr(self, name)
             
         return None
+
+
+    def as_tuple(self, text = False):
+        """
+        Returns the values of all the message elements, in layout order
+
+        @param  text    Return the elements holding 6-bit text, see
+                        AISLayout, as strings instead of integers
+        """
+        layout = self._layout
+        values = layout.values(self)
+
+        if text and layout.text_columns:
+            values = list(values)
+
+            for i, nchars in layout.text_columns:
+                values[i] = AISInt2String(values[i], nchars)
+
+            values = tuple(values)
+
+        return values
+
+
+    def as_dict(self, text = False):
+        """
+        Returns a dict mapping the message element names to their values, see
+        as_tuple()
+        """
+        return dict(zip(self._layout.names, self.as_tuple(text)))
+
+
+    def pack(self):
+        """
+        Returns the message bits as one integer of self._layout.length bits
+        """
+        return self._layout.pack(self)
+
+
+    @classmethod
+    def from_bits(cls, value, length):
+        """
+        Returns a new message unpacked from an integer holding length bits,
+        without first loading the default element values
+        """
+        return cls._layout.unpack_into(cls.__new__(cls), value, length)
+
+
+    @classmethod
+    def from_payload(cls, payload, fillbits, header):
+        """
+        Returns a new lazily decoded message. Only the given header elements
+        are set, the armored payload is de-armored and unpacked the first time
+        any other element is accessed, or any element is set
+        """
+        lazycls = _lazy_classes.get(cls)
+
+        if lazycls is None:
+            lazycls = _lazy_classes[cls] = type("Lazy" + cls.__name__,
+                    (_LazyMessage, cls), {"__slots__": (), "_base": cls})
+
+        aismsg = lazycls.__new__(lazycls)
+        object.__setattr__(aismsg, "_lazy", (payload, fillbits))
+
+        for name, value in header.items():
+            object.__setattr__(aismsg, name, value)
+
+        return aismsg
+
+
+    def __reduce__(self):
+        """
+        Messages are pickled as their packed bits, which keeps them compact
+        when passed between processes
+        """
+        return (_unpickle_message, (type(self), self.pack(), self._layout.length))
+
+
+    def unpack_bits(self, value, length):
+        """
+        Unpack the message elements from an integer holding length bits
+        """
+        self._layout.unpack_into(self, value, length)
+
         
-    ## Sub-classes should implement the methods below ##
-    
     def build_bitstream(self):
         """
-        Build the bitstream which we will be using to encode the payload. This will
-        basically involve concatenating all the message elements into one bitstring.
-        
-        Sub-classes that extend the AISMessage class are required to implement this
-        method. Example implementation:
-        
-            return bitstring.Bits().join([
-                self.element_1, self.element_2, [...]
-            ])
+        Build the bitstream which we will be using to encode the payload. This 
+        concatenates all the message elements, in the order given by the
+        message layout, into one bitstring.
         """
-        pass
+        return bitstring.Bits(uint=self.pack(), length=self._layout.length)
 
         
     def unpack(self, bitstream):
         """
-        Unpack a bitstream into AIS message elements. Sub-classes can optionally
-        implement this method to support decoding of AIS messages. Example
-        implementation:
-            
-            self._attrs["element_1"] = bitstring.Bits(bin=bitstream[0:6])
-            self._attrs["element_2"] = bitstring.Bits(bin=bitstream[6:8])
-            [...]
+        Unpack a bitstream into AIS message elements. The bitstream is a
+        string of '0' and '1' characters
         """
-        pass
+        self.unpack_bits(int(bitstream, 2) if bitstream else 0, len(bitstream))
+
+
+
+class _LazyMessage(object):
+
+    """
+    Base of the lazily decoded variant of each AISMessage sub-class, created by
+    AISMessage.from_payload(). The first access to an element which is not
+    set yet, or any assignment, unpacks the payload and turns the message into
+    an instance of the plain class, so later accesses cost nothing extra
+    """
+
+    __slots__ = ()
+
+
+    def _load(self):
+        payload, fillbits = self._lazy
+        value, length = dearmor(payload, fillbits)
+        object.__setattr__(self, "__class__", self._base)
+        self._lazy = None
+        self._layout.unpack_into(self, value, length)
+
+
+    def __getattr__(self, name):
+        self._load()
+        return getattr(self, name)
+
+
+    def __setattr__(self, name, value):
+        self._load()
+        setattr(self, name, value)
+
+
+    def __reduce__(self):
+        self._load()
+        return self.__reduce__()
+
+
+# Maps AISMessage sub-classes to their lazily decoded variant
+_lazy_classes = {}
+
+
+def _unpickle_message(aisclass, value, length):
+    return aisclass.from_bits(value, length)
 
 
 
 class AISPositionReportMessage(AISMessage):
 
+    _layout = AISLayout([
+        # message_element, data_type, num_bits
+        ('id',          "uint", 6),
+        ('repeat',      "uint", 2),
+        ('mmsi',        "uint", 30),
+        ('status',      "uint", 4),
+        ('rot',         "int",  8),
+        ('sog',         "uint", 10),
+        ('pa',          "uint", 1),
+        ('lon',         "int",  28),
+        ('lat',         "int",  27),
+        ('cog',         "uint", 12),
+        ('heading',     "uint", 9),
+        ('ts',          "uint", 6),
+        ('smi',         "uint", 2),
+        ('spare',       "uint", 3),
+        ('raim',        "uint", 1),
+        ('comm_state',  "uint", 19)
+    ])
+    __slots__ = _layout.names
+
 
     def __init__(self, id=1, repeat=0, mmsi=0, status=15, rot=0, sog=1023, pa=0,
                        lon=181, lat=91, cog=3600, heading=511, ts=60, smi=0, spare=0, 
@@ -185,70 +554,54 @@ class AISPositionReportMessage(AISMessage):
             aismsg = AISPositionReportMessage(mmsi=12345, lon=4567, lat=5432)
         """
         super(AISPositionReportMessage, self).__init__({
-                    # message_element : ["data_type", num_bits, initial_value]
-                    'id'        : ["uint", 6, id], 
-                    'repeat'    : ["uint", 2, repeat], 
-                    'mmsi'      : ["uint", 30, mmsi], 
-                    'status'    : ["uint", 4, status], 
-                    'rot'       : ["int", 8, rot], 
-                    'sog'       : ["uint", 10, sog], 
-                    'pa'        : ["uint", 1, pa], 
-                    'lon'       : ["int", 28, lon], 
-                    'lat'       : ["int", 27, lat], 
-                    'cog'       : ["uint", 12, cog], 
-                    'heading'   : ["uint", 9, heading], 
-                    'ts'        : ["uint", 6, ts], 
-                    'smi'       : ["uint", 2, smi], 
-                    'spare'     : ["uint", 3, spare], 
-                    'raim'      : ["uint", 1, raim], 
-                    'comm_state' : ["uint", 19, comm_state]
+                    'id'        : id, 
+                    'repeat'    : repeat, 
+                    'mmsi'      : mmsi, 
+                    'status'    : status, 
+                    'rot'       : rot, 
+                    'sog'       : sog, 
+                    'pa'        : pa, 
+                    'lon'       : lon, 
+                    'lat'       : lat, 
+                    'cog'       : cog, 
+                    'heading'   : heading, 
+                    'ts'        : ts, 
+                    'smi'       : smi, 
+                    'spare'     : spare, 
+                    'raim'      : raim, 
+                    'comm_state' : comm_state
                 })
 
 
-    def build_bitstream(self):
-        return bitstring.Bits().join([
-            self.id,
-            self.repeat,
-            self.mmsi,
-            self.status,
-            self.rot,
-            self.sog,
-            self.pa,
-            self.lon,
-            self.lat,
-            self.cog,
-            self.heading,
-            self.ts,
-            self.smi,
-            self.spare,
-            self.raim,
-            self.comm_state
-        ])
-
-
-    def unpack(self, bitstream):
-        # TODO: figure out a better way to do this, but works fine for now
-        self._attrs["id"]       = bitstring.Bits(bin=bitstream[0:6])
-        self._attrs["repeat"]   = bitstring.Bits(bin=bitstream[6:8])
-        self._attrs["mmsi"]     = bitstring.Bits(bin=bitstream[8:38])
-        self._attrs["status"]   = bitstring.Bits(bin=bitstream[38:42])
-        self._attrs["rot"]      = bitstring.Bits(bin=bitstream[42:50])
-        self._attrs["sog"]      = bitstring.Bits(bin=bitstream[50:60])
-        self._attrs["pa"]       = bitstring.Bits(bin=bitstream[60:61])
-        self._attrs["lon"]      = bitstring.Bits(bin=bitstream[61:89])
-        self._attrs["lat"]      = bitstring.Bits(bin=bitstream[89:116])
-        self._attrs["cog"]      = bitstring.Bits(bin=bitstream[116:128])
-        self._attrs["heading"]  = bitstring.Bits(bin=bitstream[128:137])
-        self._attrs["ts"]       = bitstring.Bits(bin=bitstream[137:143])
-        self._attrs["smi"]      = bitstring.Bits(bin=bitstream[143:145])
-        self._attrs["spare"]    = bitstring.Bits(bin=bitstream[145:148])
-        self._attrs["raim"]     = bitstring.Bits(bin=bitstream[148:149])
-        self._attrs["comm_state"] = bitstring.Bits(bin=bitstream[149:168])
-
-
 
 class AISStaticAndVoyageReportMessage(AISMessage):
 
+    _layout = AISLayout([
+        # message_element, data_type, num_bits
+        ('id',            "uint", 6),
+        ('repeat',        "uint", 2),
+        ('mmsi',          "uint", 30),
+        ('ais_version',   "uint", 2),
+        ('imo',           "uint", 30),
+        ('callsign',      "int",  42),
+        ('shipname',      "int",  120),
+        ('shiptype',      "uint", 8),
+        ('to_bow',        "uint", 9),
+        ('to_stern',      "uint", 9),
+        ('to_port',       "uint", 6),
+        ('to_starboard',  "uint", 6),
+        ('epfd',          "uint", 4),
+        ('month',         "uint", 4),
+        ('day',           "uint", 5),
+        ('hour',          "uint", 5),
+        ('minute',        "uint", 6),
+        ('draught',       "uint", 8),
+        ('destination',   "int",  120),
+        ('dte',           "uint", 1),
+        ('spare',         "uint", 1)
+    ], text = ('callsign', 'shipname', 'destination'))
+    __slots__ = _layout.names
+
 
     def __init__(self, id=5, repeat=0, mmsi=0, ais_version=0, imo=0, callsign=0, shipname=0,
                        shiptype=0, to_bow=0, to_stern=0, to_port=0, to_starboard=0, epfd=1,
@@ -263,85 +616,44 @@ class AISStaticAndVoyageReportMessage(AISMessage):
             aismsg = AISStaticAndVoyageReportMessage(mmsi=12345,shipname='ASIAN JADE')
         """
         super(AISStaticAndVoyageReportMessage, self).__init__({
-                    # message_element : ["data_type", num_bits, initial_value]
-                    'id'           : ["uint", 6, id], 
-                    'repeat'       : ["uint", 2, repeat], 
-                    'mmsi'         : ["uint", 30, mmsi], 
-                    'ais_version'  : ["uint", 2, ais_version], 
-                    'imo'          : ["uint", 30, imo], 
-                    'callsign'     : ["int", 42, AISString2Bits(callsign,length=old_div(42,6)).int if type(callsign) == str else callsign], 
-                    'shipname'     : ["int", 120, AISString2Bits(shipname,length=old_div(120,6)).int if type(shipname) == str else shipname], 
-                    'shiptype'     : ["uint", 8, shiptype], 
-                    'to_bow'       : ["uint", 9, to_bow], 
-                    'to_stern'     : ["uint", 9, to_stern], 
-                    'to_port'      : ["uint", 6, to_port], 
-                    'to_starboard' : ["uint", 6, to_starboard], 
-                    'epfd'         : ["uint", 4, epfd], 
-                    'month'        : ["uint", 4, month], 
-                    'day'          : ["uint", 5, day], 
-                    'hour'         : ["uint", 5, hour], 
-                    'minute'       : ["uint", 6, minute], 
-                    'draught'      : ["uint", 8, draught], 
-                    'destination'  : ["int", 120, AISString2Bits(destination,length=old_div(120,6)).int if type(destination) == str else destination], 
-                    'dte'          : ["uint", 1, dte], 
-                    'spare'        : ["uint", 1, spare]
+                    'id'           : id, 
+                    'repeat'       : repeat, 
+                    'mmsi'         : mmsi, 
+                    'ais_version'  : ais_version, 
+                    'imo'          : imo, 
+                    'callsign'     : AISString2Int(callsign,length=old_div(42,6)) if type(callsign) == str else callsign, 
+                    'shipname'     : AISString2Int(shipname,length=old_div(120,6)) if type(shipname) == str else shipname, 
+                    'shiptype'     : shiptype, 
+                    'to_bow'       : to_bow, 
+                    'to_stern'     : to_stern, 
+                    'to_port'      : to_port, 
+                    'to_starboard' : to_starboard, 
+                    'epfd'         : epfd, 
+                    'month'        : month, 
+                    'day'          : day, 
+                    'hour'         : hour, 
+                    'minute'       : minute, 
+                    'draught'      : draught, 
+                    'destination'  : AISString2Int(destination,length=old_div(120,6)) if type(destination) == str else destination, 
+                    'dte'          : dte, 
+                    'spare'        : spare
                 })
 
 
-    def build_bitstream(self):
-        return bitstring.Bits().join([
-            self.id,
-            self.repeat,
-            self.mmsi,
-            self.ais_version,
-            self.imo,
-            self.callsign,
-            self.shipname,
-            self.shiptype,
-            self.to_bow,
-            self.to_stern,
-            self.to_port,
-            self.to_starboard,
-            self.epfd,
-            self.month,
-            self.day,
-            self.hour,
-            self.minute,
-            self.draught,
-            self.destination,
-            self.dte,
-            self.spare
-        ])
-
-
-    def unpack(self, bitstream):
-        # TODO: figure out a better way to do this, but works fine for now
-        self._attrs["id"]       = bitstring.Bits(bin=bitstream[0:6])
-        self._attrs["repeat"]   = bitstring.Bits(bin=bitstream[6:8])
-        self._attrs["mmsi"]     = bitstring.Bits(bin=bitstream[8:38])
-        self._attrs["ais_version"]   = bitstring.Bits(bin=bitstream[38:40])
-        self._attrs["imo"]      = bitstring.Bits(bin=bitstream[40:70])
-        self._attrs["callsign"]      = bitstring.Bits(bin=bitstream[70:112])
-        self._attrs["shipname"]       = bitstring.Bits(bin=bitstream[112:232])
-        self._attrs["shiptype"]      = bitstring.Bits(bin=bitstream[232:240])
-        self._attrs["to_bow"]      = bitstring.Bits(bin=bitstream[240:249])
-        self._attrs["to_stern"]      = bitstring.Bits(bin=bitstream[249:258])
-        self._attrs["to_port"]  = bitstring.Bits(bin=bitstream[258:264])
-        self._attrs["to_starboard"]       = bitstring.Bits(bin=bitstream[264:270])
-        self._attrs["epfd"]      = bitstring.Bits(bin=bitstream[270:274])
-        self._attrs["month"]    = bitstring.Bits(bin=bitstream[274:278])
-        self._attrs["day"]     = bitstring.Bits(bin=bitstream[278:283])
-        self._attrs["hour"]     = bitstring.Bits(bin=bitstream[283:288])
-        self._attrs["minute"]     = bitstring.Bits(bin=bitstream[288:294])
-        self._attrs["draught"]     = bitstring.Bits(bin=bitstream[294:302])
-        self._attrs["destination"]     = bitstring.Bits(bin=bitstream[302:422])
-        self._attrs["dte"]     = bitstring.Bits(bin=bitstream[422:423])
-        self._attrs["spare"] = bitstring.Bits(bin=bitstream[423:424])
-
-
 
 class AISStaticDataReportAMessage(AISMessage):
 
+    _layout = AISLayout([
+        # message_element, data_type, num_bits
+        ('id',        "uint", 6),
+        ('repeat',    "uint", 2),
+        ('mmsi',      "uint", 30),
+        ('partno',    "uint", 2),
+        ('shipname',  "int",  120),
+        ('spare',     "uint", 8)
+    ], text = ('shipname',))
+    __slots__ = _layout.names
+
 
     def __init__(self, id=24, repeat=0, mmsi=0, partno=0, shipname=0, spare=0):
         """
@@ -352,40 +664,37 @@ class AISStaticDataReportAMessage(AISMessage):
             aismsg = AISPositionReportAMessage(mmsi=12345, shipname='ASIAN JADE')
         """        
         super(AISStaticDataReportAMessage, self).__init__({
-                    # message_element : ["data_type", num_bits, initial_value]
-                    'id'              : ["uint", 6, id], 
-                    'repeat'          : ["uint", 2, repeat], 
-                    'mmsi'            : ["uint", 30, mmsi], 
-                    'partno'          : ["uint", 2, partno], 
-                    'shipname'        : ["int", 120, AISString2Bits(shipname,length=old_div(120,6)).int if type(shipname) == str else shipname], 
-                    'spare'           : ["uint", 8, spare]
+                    'id'              : id, 
+                    'repeat'          : repeat, 
+                    'mmsi'            : mmsi, 
+                    'partno'          : partno, 
+                    'shipname'        : AISString2Int(shipname,length=old_div(120,6)) if type(shipname) == str else shipname, 
+                    'spare'           : spare
                 })
 
 
-    def build_bitstream(self):
-        return bitstring.Bits().join([
-            self.id,
-            self.repeat,
-            self.mmsi,
-            self.partno,
-            self.shipname,
-            self.spare
-        ])
-
-
-    def unpack(self, bitstream):
-        # TODO: figure out a better way to do this, but works fine for now
-        self._attrs["id"]       = bitstring.Bits(bin=bitstream[0:6])
-        self._attrs["repeat"]   = bitstring.Bits(bin=bitstream[6:8])
-        self._attrs["mmsi"]     = bitstring.Bits(bin=bitstream[8:38])
-        self._attrs["partno"]   = bitstring.Bits(bin=bitstream[38:40])
-        self._attrs["shipname"]      = bitstring.Bits(bin=bitstream[40:160])
-        self._attrs["spare"]      = bitstring.Bits(bin=bitstream[160:168])
-
-
 
 class AISStaticDataReportBMessage(AISMessage):
 
+    _layout = AISLayout([
+        # message_element, data_type, num_bits
+        ('id',            "uint", 6),
+        ('repeat',        "uint", 2),
+        ('mmsi',          "uint", 30),
+        ('partno',        "uint", 2),
+        ('shiptype',      "uint", 8),
+        ('vendorid',      "int",  18),
+        ('model',         "uint", 4),
+        ('serial',        "uint", 20),
+        ('callsign',      "int",  42),
+        ('to_bow',        "uint", 9),
+        ('to_stern',      "uint", 9),
+        ('to_port',       "uint", 6),
+        ('to_starboard',  "uint", 6),
+        ('spare',         "uint", 6)
+    ], text = ('vendorid', 'callsign'))
+    __slots__ = _layout.names
+
 
     def __init__(self, id=24, repeat=0, mmsi=0, partno=1, shiptype=0,
                        vendorid=0,model=0,serial=0,callsign=0,
@@ -399,225 +708,158 @@ class AISStaticDataReportBMessage(AISMessage):
             aismsg = AISPositionReportBMessage(mmsi=12345, shiptype=60)
         """        
         super(AISStaticDataReportBMessage, self).__init__({
-                    # message_element : ["data_type", num_bits, initial_value]
-                    'id'              : ["uint", 6, id], 
-                    'repeat'          : ["uint", 2, repeat], 
-                    'mmsi'            : ["uint", 30, mmsi], 
-                    'partno'          : ["uint", 2, partno], 
-                    'shiptype'        : ["uint", 8, shiptype], 
-                    'vendorid'        : ["int", 18, AISString2Bits(vendorid,length=old_div(18,6)).int if type(vendorid) == str else vendorid], 
-                    'model'           : ["uint", 4, model], 
-                    'serial'          : ["uint", 20, serial], 
-                    'callsign'        : ["int", 42, AISString2Bits(callsign,length=old_div(42,6)).int if type(callsign) == str else callsign], 
-                    'to_bow'          : ["uint", 9, to_bow], 
-                    'to_stern'        : ["uint", 9, to_stern], 
-                    'to_port'         : ["uint", 6, to_port], 
-                    'to_starboard'    : ["uint", 6, to_starboard], 
-                    'spare'           : ["uint", 6, spare]
+                    'id'              : id, 
+                    'repeat'          : repeat, 
+                    'mmsi'            : mmsi, 
+                    'partno'          : partno, 
+                    'shiptype'        : shiptype, 
+                    'vendorid'        : AISString2Int(vendorid,length=old_div(18,6)) if type(vendorid) == str else vendorid, 
+                    'model'           : model, 
+                    'serial'          : serial, 
+                    'callsign'        : AISString2Int(callsign,length=old_div(42,6)) if type(callsign) == str else callsign, 
+                    'to_bow'          : to_bow, 
+                    'to_stern'        : to_stern, 
+                    'to_port'         : to_port, 
+                    'to_starboard'    : to_starboard, 
+                    'spare'           : spare
                 })
 
 
-    def build_bitstream(self):
-        return bitstring.Bits().join([
-            self.id,
-            self.repeat,
-            self.mmsi,
-            self.partno,
-            self.shiptype,
-            self.vendorid,
-            self.model,
-            self.serial,
-            self.callsign,
-            self.to_bow,
-            self.to_stern,
-            self.to_port,
-            self.to_starboard,
-            self.spare
-        ])
-
-
-    def unpack(self, bitstream):
-        # TODO: figure out a better way to do this, but works fine for now
-        self._attrs["id"]       = bitstring.Bits(bin=bitstream[0:6])
-        self._attrs["repeat"]   = bitstring.Bits(bin=bitstream[6:8])
-        self._attrs["mmsi"]     = bitstring.Bits(bin=bitstream[8:38])
-        self._attrs["partno"]   = bitstring.Bits(bin=bitstream[38:40])
-        self._attrs["shiptype"] = bitstring.Bits(bin=bitstream[40:48])
-        self._attrs["vendorid"] = bitstring.Bits(bin=bitstream[48:66])
-        self._attrs["model"]    = bitstring.Bits(bin=bitstream[66:70])
-        self._attrs["serial"]   = bitstring.Bits(bin=bitstream[70:90])
-        self._attrs["callsign"] = bitstring.Bits(bin=bitstream[90:132])
-        self._attrs["to_bow"]   = bitstring.Bits(bin=bitstream[132:141])
-        self._attrs["to_stern"] = bitstring.Bits(bin=bitstream[141:150])
-        self._attrs["to_port"]  = bitstring.Bits(bin=bitstream[150:156])
-        self._attrs["to_starboard"]  = bitstring.Bits(bin=bitstream[156:162])
-        self._attrs["spare"]      = bitstring.Bits(bin=bitstream[162:168])
-
-
 
 class AISBinaryBroadcastMessageAreaNoticeCircle(AISMessage):
 
+    _layout = AISLayout([
+        # message_element, data_type, num_bits
+        ('id',              "uint", 6),
+        ('repeat',          "uint", 2),
+        ('mmsi',            "uint", 30),
+        ('spare',           "uint", 2),
+        ('dac',             "uint", 10),
+        ('fid',             "uint", 6),
+        ('linkage',         "uint", 10),
+        ('notice',          "uint", 7),
+        ('month',           "uint", 4),
+        ('day',             "uint", 5),
+        ('hour',            "uint", 5),
+        ('minute',          "uint", 6),
+        ('duration',        "uint", 18),
+        ('subarea_type_1',  "uint", 3),
+        ('scale_1',         "uint", 2),
+        ('lon_1',           "int",  25),
+        ('lat_1',           "int",  24),
+        ('precision_1',     "uint", 3),
+        ('radius_1',        "uint", 12),
+        ('spare_1',         "uint", 10)
+    ])
+    __slots__ = _layout.names
+
 
     def __init__(self, id = 8, repeat = 0, mmsi = 0, linkage = 0, notice = 34, month = 12, day = 1, hour = 0, minute = 0, duration = 43200, scale_1 = 0, lon_1 = 181000, lat_1 = 91000, precision_1 = 4, radius_1 = 0):
 
         super(AISBinaryBroadcastMessageAreaNoticeCircle, self).__init__({
-                    # message_element : ["data_type", num_bits, initial_value]
-                    'id'              : ["uint", 6, id], 
-                    'repeat'          : ["uint", 2, repeat], 
-                    'mmsi'            : ["uint", 30, mmsi], 
-                    'spare'           : ["uint", 2, 0], 
-                    'dac'             : ["uint", 10, 1], 
-                    'fid'             : ["uint", 6, 22],
-                    'linkage'         : ["uint", 10, linkage], 
-                    'notice'          : ["uint", 7, notice], 
-                    'month'           : ["uint", 4, month], 
-                    'day'             : ["uint", 5, day], 
-                    'hour'            : ["uint", 5, hour], 
-                    'minute'          : ["uint", 6, minute], 
-                    'duration'        : ["uint", 18, duration], 
-                    'subarea_type_1'  : ["uint", 3, 0], 
-                    'scale_1'         : ["uint", 2, scale_1], 
-                    'lon_1'           : ["int", 25, lon_1], 
-                    'lat_1'           : ["int", 24, lat_1], 
-                    'precision_1'     : ["uint", 3, precision_1], 
-                    'radius_1'        : ["uint", 12, radius_1], 
-                    'spare_1'         : ["uint", 10, 0]
+                    'id'              : id, 
+                    'repeat'          : repeat, 
+                    'mmsi'            : mmsi, 
+                    'spare'           : 0, 
+                    'dac'             : 1, 
+                    'fid'             : 22,
+                    'linkage'         : linkage, 
+                    'notice'          : notice, 
+                    'month'           : month, 
+                    'day'             : day, 
+                    'hour'            : hour, 
+                    'minute'          : minute, 
+                    'duration'        : duration, 
+                    'subarea_type_1'  : 0, 
+                    'scale_1'         : scale_1, 
+                    'lon_1'           : lon_1, 
+                    'lat_1'           : lat_1, 
+                    'precision_1'     : precision_1, 
+                    'radius_1'        : radius_1, 
+                    'spare_1'         : 0
                 })
 
 
-    def build_bitstream(self):
-        return bitstring.Bits().join([
-            self.id,
-            self.repeat,
-            self.mmsi,
-            self.spare,
-            self.dac,
-            self.fid,
-            self.linkage,
-            self.notice,
-            self.month,
-            self.day,
-            self.hour,
-            self.minute,
-            self.duration,
-            self.subarea_type_1,
-            self.scale_1,
-            self.lon_1,
-            self.lat_1,
-            self.precision_1,
-            self.radius_1,
-            self.spare_1
-        ])
-
-
-    def unpack(self, bitstream):
-        # TODO: figure out a better way to do this, but works fine for now
-        self._attrs["id"]             = bitstring.Bits(bin=bitstream[0:6])
-        self._attrs["repeat"]         = bitstring.Bits(bin=bitstream[6:8])
-        self._attrs["mmsi"]           = bitstring.Bits(bin=bitstream[8:38])
-        self._attrs["spare"]          = bitstring.Bits(bin=bitstream[38:40])
-        self._attrs["dac"]            = bitstring.Bits(bin=bitstream[40:50])
-        self._attrs["fid"]            = bitstring.Bits(bin=bitstream[50:56])
-        self._attrs["linkage"]        = bitstring.Bits(bin=bitstream[56:66])
-        self._attrs["notice"]         = bitstring.Bits(bin=bitstream[66:73])
-        self._attrs["month"]          = bitstring.Bits(bin=bitstream[73:77])
-        self._attrs["day"]            = bitstring.Bits(bin=bitstream[77:82])
-        self._attrs["hour"]           = bitstring.Bits(bin=bitstream[82:87])
-        self._attrs["minute"]         = bitstring.Bits(bin=bitstream[87:93])
-        self._attrs["duration"]       = bitstring.Bits(bin=bitstream[93:111])
-        self._attrs["subarea_type_1"] = bitstring.Bits(bin=bitstream[111:114])
-        self._attrs["scale_1"]        = bitstring.Bits(bin=bitstream[114:116])
-        self._attrs["lon_1"]          = bitstring.Bits(bin=bitstream[116:141])
-        self._attrs["lat_1"]          = bitstring.Bits(bin=bitstream[141:165])
-        self._attrs["precision_1"]    = bitstring.Bits(bin=bitstream[165:168])
-        self._attrs["radius_1"]       = bitstring.Bits(bin=bitstream[168:180])
-        self._attrs["spare_1"]        = bitstring.Bits(bin=bitstream[180:198])
-
-
 
 class AISAtonReport(AISMessage):
 
+    _layout = AISLayout([
+        # message_element, data_type, num_bits
+        ('id',            "uint", 6),
+        ('repeat',        "uint", 2),
+        ('mmsi',          "uint", 30),
+        ('aid_type',      "uint", 5),
+        ('name',          "int",  120),
+        ('accuracy',      "uint", 1),
+        ('lon',           "int",  28),
+        ('lat',           "int",  27),
+        ('to_bow',        "uint", 9),
+        ('to_stern',      "uint", 9),
+        ('to_port',       "uint", 6),
+        ('to_starboard',  "uint", 6),
+        ('epfd',          "uint", 4),
+        ('ts',            "uint", 6),
+        ('off_position',  "uint", 1),
+        ('regional',      "uint", 8),
+        ('raim',          "uint", 1),
+        ('virtual_aid',   "uint", 1),
+        ('assigned',      "uint", 1),
+        ('spare',         "uint", 1),
+        ('name_ext',      "int",  84),
+        ('pad',           "uint", 4)
+    ], text = ('name', 'name_ext'))
+    __slots__ = _layout.names
+
 
     def __init__(self, repeat = 0, mmsi = 0, aid_type = 0, name = 0, accuracy = 0, lon = 181000, lat = 91000, to_bow = 0, to_stern = 0, to_port = 0, to_starboard = 0, epfd = 0, ts = 60, off_position = 0, raim = 0, virtual_aid = 0, assigned = 0, name_ext = 0):
 
         super(AISAtonReport, self).__init__({
-                    # message_element : ["data_type", num_bits, initial_value]
-                    'id'              : ["uint", 6, 21], 
-                    'repeat'          : ["uint", 2, repeat], 
-                    'mmsi'            : ["uint", 30, mmsi], 
-                    'aid_type'        : ["uint", 5, aid_type], 
-                    'name'            : ["int", 120, AISString2Bits(name,length=old_div(120,6)).int if type(name) == str else name], 
-                    'accuracy'        : ["uint", 1, accuracy],
-                    'lon'             : ["int", 28, lon], 
-                    'lat'             : ["int", 27, lat], 
-                    'to_bow'          : ["uint", 9, to_bow], 
-                    'to_stern'        : ["uint", 9, to_stern], 
-                    'to_port'         : ["uint", 6, to_port], 
-                    'to_starboard'    : ["uint", 6, to_starboard], 
-                    'epfd'            : ["uint", 4, epfd], 
-                    'ts'              : ["uint", 6, ts], 
-                    'off_position'    : ["uint", 1, off_position], 
-                    'regional'        : ["uint", 8, 0], 
-                    'raim'            : ["uint", 1, raim], 
-                    'virtual_aid'     : ["uint", 1, virtual_aid], 
-                    'assigned'        : ["uint", 1, assigned], 
-                    'spare'           : ["uint", 1, 0],
-                    'name_ext'        : ["int", 84, AISString2Bits(name_ext,length=old_div(84,6)).int if type(name_ext) == str else name_ext], 
-                    'pad'             : ["uint", 4, 0]
+                    'id'              : 21, 
+                    'repeat'          : repeat, 
+                    'mmsi'            : mmsi, 
+                    'aid_type'        : aid_type, 
+                    'name'            : AISString2Int(name,length=old_div(120,6)) if type(name) == str else name, 
+                    'accuracy'        : accuracy,
+                    'lon'             : lon, 
+                    'lat'             : lat, 
+                    'to_bow'          : to_bow, 
+                    'to_stern'        : to_stern, 
+                    'to_port'         : to_port, 
+                    'to_starboard'    : to_starboard, 
+                    'epfd'            : epfd, 
+                    'ts'              : ts, 
+                    'off_position'    : off_position, 
+                    'regional'        : 0, 
+                    'raim'            : raim, 
+                    'virtual_aid'     : virtual_aid, 
+                    'assigned'        : assigned, 
+                    'spare'           : 0,
+                    'name_ext'        : AISString2Int(name_ext,length=old_div(84,6)) if type(name_ext) == str else name_ext, 
+                    'pad'             : 0
                 })
 
 
-    def build_bitstream(self):
-        return bitstring.Bits().join([
-            self.id,
-            self.repeat,
-            self.mmsi,
-            self.aid_type,
-            self.name,
-            self.accuracy,
-            self.lon,
-            self.lat,
-            self.to_bow,
-            self.to_stern,
-            self.to_port,
-            self.to_starboard,
-            self.epfd,
-            self.ts,
-            self.off_position,
-            self.regional,
-            self.raim,
-            self.virtual_aid,
-            self.assigned,
-            self.spare,
-            self.name_ext,
-            self.pad
-        ])
 
+# Maximum number of payload characters per NMEA sentence. With the 20
+# characters of the other fields this keeps sentences within 82 characters
+max_fragment_payload = 60
+
+# Rotating sequential message IDs of multi-sentence messages
+_sequence_ids = itertools.cycle(range(10))
 
-    def unpack(self, bitstream):
-        # TODO: figure out a better way to do this, but works fine for now
-        self._attrs["id"]           = bitstring.Bits(bin=bitstream[0:6])
-        self._attrs["repeat"]       = bitstring.Bits(bin=bitstream[6:8])
-        self._attrs["mmsi"]         = bitstring.Bits(bin=bitstream[8:38])
-        self._attrs["aid_type"]     = bitstring.Bits(bin=bitstream[38:43])
-        self._attrs["name"]         = bitstring.Bits(bin=bitstream[43:163])
-        self._attrs["accuracy"]     = bitstring.Bits(bin=bitstream[163:164])
-        self._attrs["lon"]          = bitstring.Bits(bin=bitstream[164:192])
-        self._attrs["lat"]          = bitstring.Bits(bin=bitstream[192:219])
-        self._attrs["to_bow"]       = bitstring.Bits(bin=bitstream[219:228])
-        self._attrs["to_stern"]     = bitstring.Bits(bin=bitstream[228:237])
-        self._attrs["to_port"]      = bitstring.Bits(bin=bitstream[237:243])
-        self._attrs["to_starboard"] = bitstring.Bits(bin=bitstream[243:249])
-        self._attrs["epfd"]         = bitstring.Bits(bin=bitstream[249:253])
-        self._attrs["ts"]           = bitstring.Bits(bin=bitstream[253:259])
-        self._attrs["off_position"] = bitstring.Bits(bin=bitstream[259:260])
-        self._attrs["regional"]     = bitstring.Bits(bin=bitstream[260:268])
-        self._attrs["raim"]         = bitstring.Bits(bin=bitstream[268:269])
-        self._attrs["virtual_aid"]  = bitstring.Bits(bin=bitstream[269:270])
-        self._attrs["assigned"]     = bitstring.Bits(bin=bitstream[270:271])
-        self._attrs["spare"]        = bitstring.Bits(bin=bitstream[271:272])
-        self._attrs["name_ext"]     = bitstring.Bits(bin=bitstream[272:356])
-        self._attrs["pad"]          = bitstring.Bits(bin=bitstream[356:360])
+
+
+# Maps the message id to the AISMessage class decoding it. Type 24 is resolved
+# to its format A or B class by AIS.decode
+message_types = {
+    1  : AISPositionReportMessage,
+    2  : AISPositionReportMessage,
+    3  : AISPositionReportMessage,
+    5  : AISStaticAndVoyageReportMessage,
+    8  : AISBinaryBroadcastMessageAreaNoticeCircle,
+    21 : AISAtonReport,
+    24 : AISStaticDataReportAMessage
+}
 
 
 
@@ -661,8 +903,18 @@ class AIS(object):
         
         Field 7 (0) is the number of fill bits requires to pad the data payload 
         to a 6-bit boundary. This value can range from 1-5.
+
+        Payloads longer than one sentence, such as type 5 and 21 messages, should
+        be built with build_sentences() instead
         """
-        
+
+        if stats is not None:
+            return stats.call("build", self._build_payload, (invert_crc,), self._ais_message)
+
+        return self._build_payload(invert_crc)
+
+
+    def _build_payload(self, invert_crc):
         payLoad =  self.encode() 
         payload = "!AIVDM,1,1,,A," + payLoad + '*'
         chksum = self.crc(payload)
@@ -673,6 +925,47 @@ class AIS(object):
         return payload + "%02X" % (chksum & 0xff)
 
 
+    def build_sentences(self, invert_crc = False, channel = "A", seq_id = None):
+        """
+        Builds the AIS NMEA message as a list of sentences. Payloads longer
+        than max_fragment_payload characters are split over several fragment
+        sentences, each with its own checksum, so that no sentence exceeds the
+        NMEA 0183 82-character limit. See build_payload() for the fields.
+
+        @param  invert_crc  Invert the checksum of every sentence
+        @param  channel     Radio channel code, field 5
+        @param  seq_id      Sequential message ID (0-9) of multi-sentence
+                            messages. By default the next ID of a rotating
+                            counter shared by all AIS instances is used
+        @return             List of NMEA sentences
+        """
+
+        payload, fillbits = self.encode().split(",")
+        size = max_fragment_payload
+        count = max(1, -(-len(payload) // size))
+
+        if count == 1:
+            seq_id = ""
+        elif seq_id is None:
+            seq_id = next(_sequence_ids)
+
+        sentences = []
+
+        for num in range(1, count + 1):
+            # Only the last fragment carries the fill bits
+            sentence = "!AIVDM,%d,%d,%s,%s,%s,%s*" % (
+                    count, num, seq_id, channel, payload[(num - 1) * size:num * size],
+                    fillbits if num == count else "0")
+            chksum = crc(sentence)
+
+            if invert_crc:
+                chksum = ~chksum
+
+            sentences.append(sentence + "%02X" % (chksum & 0xff))
+
+        return sentences
+
+
     def encode(self, bitstr = None):
         """
         Encode a bitstream into a 6-bit encoded AIS message string
@@ -682,116 +975,1537 @@ class AIS(object):
                         it will use the bitstring from the '_ais_message' property
         @return         6-bit encoded AIS string
         """
-        
-        curr_index = 0
-        curr_offset = 6     # We'll be encoding 6 bits at a time
-        encoded_str = []
-        
+
+        if stats is not None:
+            return stats.call("encode", self._encode, (bitstr,), self._ais_message)
+
+        return self._encode(bitstr)
+
+
+    def _encode(self, bitstr):
         if bitstr == None:
-            bitstr = self._ais_message.build_bitstream()
-        
-        # The total AIS message is len(bitstr) bits
-        # Since we are encoding 6-bit chunks, we are looping
-        #  round(len(bitstr)/ 6.) times (type 5 has 424 bits which does not divide by 6
-       #print len(bitstr),len(bitstr)/6,len(bitstr)/6.,int(round(len(bitstr)/6.))
-        for i in range(0, int(round(len(bitstr)/6.))):
-            block = bitstr[curr_index:curr_offset]
-            encoded_str.append(encodingchars[block.uint])
-            curr_index += 6
-            curr_offset += 6
-        remainingbits = len(bitstr) %6
-        fillbits = (6 -remainingbits) if remainingbits !=0 else 0
+            value = self._ais_message.pack()
+            length = self._ais_message._layout.length
+        else:
+            value = bitstr.uint if len(bitstr) else 0
+            length = len(bitstr)
 
-        return ("".join(encoded_str))+','+chr(ord('0')+fillbits)
+        return armor(value, length)
 
 
     def decode(self, msg, ignore_crc = False):
 
         """
-        Decodes an AIS NMEA formatted message. Currently supports message 
-        types 1, 5, 21 and 24. On success, returns an instance of 
-        AISPositionReportMessage. A CRC check is performed. If the CRC does not 
-        match, a CRCInvalidError exception is thrown
+        Decodes an AIS NMEA formatted message. See the module level decode()
         
         @param  msg     The message to decode
-        @return         If CRC checks, returns an instance of AISPositionReportMessage
+        @return         If CRC checks, returns an instance of AISMessage
         """
 
-        computed_crc = self.crc(msg)
-        given_crc = int(msg[-2:], 16)
-
-        # If CRC did not match, throw exception!
-        if given_crc != computed_crc and not ignore_crc : 
-            raise CRCInvalidError("The given CRC did not match the computed CRC.")
-            
-        # Otherwise we can continue with decoding the message
-        # ...
-        # Grab just the payload. The 6th index in the AIS message contains the payload
-        payload,fillbits = msg.split(",")[5:7]
-        
-        # First we will reverse the 6-bit ascii encoding to its integer equivalent
-        # using our reverse encoded character map
-        dec = []
-        
-        for c in payload:
-            dec.append(re_encodingchars[c])
-        
-        # Now we will take our list of integers and convert it to a bitstream
-        bits = []
-        
-        for i in range(len(dec)):
-            bits.append(int2bin6(dec[i]))
-            
-        bitstream = "".join(bits)
-        if fillbits[0] !='0':
-            bitstream = bitstream[:-int(fillbits[0])]
-
-        msgId = bitstream[0:6]  #;print msgId
-
-        if   msgId == '000001':
-             aismsg = AISPositionReportMessage()
-        elif  msgId == '000010':
-             aismsg = AISPositionReportMessage()
-        elif  msgId == '000011':
-             aismsg = AISPositionReportMessage()
-        elif msgId == '011000' and bitstream[38] == '0':
-             aismsg = AISStaticDataReportAMessage()
-        elif msgId == '011000' and bitstream[38] == '1':
-             aismsg = AISStaticDataReportBMessage()
-        elif msgId == '000101':
-             aismsg = AISStaticAndVoyageReportMessage()
-        elif msgId == '001000':
-             aismsg = AISBinaryBroadcastMessageAreaNoticeCircle()
-        elif msgId == '010101':
-             aismsg = AISAtonReport()
-
-        aismsg.unpack(bitstream)
-
-        return aismsg
+        return decode(msg, ignore_crc)
 
         
     def crc(self, msg):
 
         """
-        Generates the CRC for the given AIS NMEA formatted string
-        
-        @param  msg     The message used to generate the CRC. This should be
-                        a well formed NMEA formatted message
-        @return         Integer representation of the CRC. You can use hex(crc)
-                        to get the hex
+        Generates the CRC for the given AIS NMEA formatted string. See the
+        module level crc()
         """
         
-        chksum = 0
-        
-        # If the input contains the entire NMEA message, then we just need to
-        # get the string between the ! and *
-        # Otherwise we'll assume the input contains just the string to checksum
-        astk = msg.rfind("*")
-        
-        if msg[0] == "!" and astk != -1:
-            msg = msg[1:astk]
-        
-        for c in msg:
-            chksum = chksum ^ ord(c)
-            
-        return chksum
+        return crc(msg)
+
+
+
+class AISSentenceCache(object):
+
+    """
+    Bounded LRU cache of the NMEA sentences of messages whose content rarely
+    changes, such as static and voyage data (types 5 and 24) and AtoN reports
+    (type 21). Entries are keyed by the message class, the element values and
+    the channel, so a message is only built and armored the first time those
+    values are seen:
+
+        cache = AISSentenceCache()
+        sentences = cache.build(AISStaticAndVoyageReportMessage, mmsi=237772000,
+                                shipname='OF THE HIGH SEAS', destination='STROFADES')
+
+    Multi-sentence messages still get a rotating sequential message ID; it is
+    patched into the cached sentences along with their checksums.
+    """
+
+    def __init__(self, maxsize = 10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+
+
+    def __len__(self):
+        return len(self._cache)
+
+
+    def build(self, aisclass, channel = "A", seq_id = None, **elements):
+        """
+        Returns the sentences of the message of class aisclass built with the
+        given elements, as AIS(aisclass(**elements)).build_sentences() would
+
+        @param  aisclass    The AISMessage sub-class
+        @param  channel     Radio channel code of the sentences
+        @param  seq_id      Sequential message ID, see AIS.build_sentences()
+        @param  elements    Keyword arguments of the aisclass constructor
+        @return             List of NMEA sentences
+        """
+        key = (aisclass, channel, tuple(sorted(elements.items())))
+        cache = self._cache
+
+        # Each entry maps the sequential message IDs used so far to their
+        # sentences, single sentence messages have no ID
+        variants = cache.get(key)
+
+        if variants is None:
+            self.misses += 1
+            sentences = AIS(aisclass(**elements)).build_sentences(channel = channel, seq_id = 0)
+            variants = cache[key] = {"" if len(sentences) == 1 else 0 : sentences}
+
+            if len(cache) > self.maxsize:
+                cache.popitem(last = False)
+        else:
+            self.hits += 1
+            cache.move_to_end(key)
+
+        if "" in variants:
+            return list(variants[""])
+
+        if seq_id is None:
+            seq_id = next(_sequence_ids)
+
+        sentences = variants.get(seq_id)
+
+        if sentences is None:
+            sentences = variants[seq_id] = [_set_seq_id(sentence, seq_id)
+                                             for sentence in variants[0]]
+
+        return list(sentences)
+
+
+    def clear(self):
+        self._cache.clear()
+
+
+class AISPreparedMessage(object):
+
+    """
+    Prepared single sentence message, for encoding a stream of reports of
+    which only a few elements change, such as the position reports of one
+    vessel. The sentence is armored once. Each build() then only rewrites
+    the bits of the changed elements, re-armors the characters holding them
+    and updates the checksum incrementally:
+
+        prepared = AISPreparedMessage(AISPositionReportMessage(mmsi=237772000, status=0))
+        sentence = prepared.build(lon=lon, lat=lat, sog=sog, cog=cog, ts=ts)
+
+    Like assigned message elements, values which do not fit in their element
+    raise TypeError or ValueError, see AISLayout.check().
+    """
+
+    def __init__(self, ais_message, channel = "A"):
+        layout = ais_message._layout
+        nchars = -(-layout.length // 6)
+
+        if nchars > max_fragment_payload:
+            raise ValueError("Message does not fit in a single sentence.")
+
+        fillbits = nchars * 6 - layout.length
+
+        # Element name -> (shift in the padded bits, mask, first char, last
+        # char, lowest value, highest value)
+        self._elements = {}
+
+        for name, shift, mask, sign in layout._specs:
+            shift += fillbits
+            end = nchars * 6 - shift
+            start = end - mask.bit_length()
+            lo, hi = (-sign, sign - 1) if sign else (0, mask)
+            self._elements[name] = (shift, mask, start // 6, (end - 1) // 6, lo, hi)
+
+        self._nchars = nchars
+        self._bits = ais_message.pack() << fillbits
+        self._chars = list(armor(self._bits, nchars * 6).split(",")[0])
+        self._head = "!AIVDM,1,1,,%s," % channel
+        self._tail = ",%d*" % fillbits
+        self._chksum = crc(self._head + "".join(self._chars) + self._tail)
+        self._layout = layout
+        self._fillbits = fillbits
+        self._class = getattr(type(ais_message), '_base', type(ais_message))
+
+
+    def build(self, **elements):
+        """
+        Sets the given elements and returns the NMEA sentence of the message
+
+        @param  elements    Element values, e.g. lat=..., lon=...
+        @return             NMEA sentence
+        """
+        bits = self._bits
+        chars = self._chars
+        chksum = self._chksum
+        last = self._nchars - 1
+        dirty_lo, dirty_hi = last + 1, -1
+
+        for name, value in elements.items():
+            shift, mask, first, final, lo, hi = self._elements[name]
+
+            if type(value) is not int or not lo <= value <= hi:
+                self._layout.check(name, value)
+
+            bits = (bits & ~(mask << shift)) | ((value & mask) << shift)
+
+            if first < dirty_lo:
+                dirty_lo = first
+            if final > dirty_hi:
+                dirty_hi = final
+
+        # Re-armor only the characters holding changed bits
+        for i in range(dirty_lo, dirty_hi + 1):
+            c = encodingchars[(bits >> (6 * (last - i))) & 0x3f]
+            old = chars[i]
+
+            if c != old:
+                chksum ^= ord(old) ^ ord(c)
+                chars[i] = c
+
+        self._bits = bits
+        self._chksum = chksum
+
+        return "%s%s%s%02X" % (self._head, "".join(chars), self._tail, chksum)
+
+
+    def message(self):
+        """
+        Returns a new AISMessage holding the current element values
+        """
+        return self._class.from_bits(self._bits >> self._fillbits, self._layout.length)
+
+
+def _set_seq_id(sentence, seq_id):
+
+    """
+    Returns a sentence built with sequential message ID 0 with seq_id instead.
+    The checksum is patched, the XOR of the old ID is cancelled out and the
+    XOR of the new one applied
+    """
+
+    seq_id = str(seq_id)
+    address, count, number, old, rest = sentence.split(",", 4)
+    chksum = int(sentence[-2:], 16) ^ _xor(old.encode("ascii")) ^ _xor(seq_id.encode("ascii"))
+
+    return "%s,%s,%s,%s,%s%02X" % (address, count, number, seq_id, rest[:-2], chksum)
+
+
+
+# A tokenized NMEA sentence, see tokenize()
+AISSentence = collections.namedtuple("AISSentence",
+        "talker sentence count number seq_id channel payload fillbits")
+
+
+def tokenize(msg, ignore_crc = False):
+
+    """
+    Splits an AIS NMEA formatted message into its fields and checks its CRC.
+    The structure is validated up front, so malformed lines are rejected
+    before any other work. The CRC is computed over the bytes of the
+    sentence body, between the ! and *
+
+    @param  msg         The message, e.g. '!AIVDM,1,1,,A,<payload>,0*5C'.
+                        Trailing whitespace is ignored
+    @param  ignore_crc  Do not check the CRC of the sentence
+    @return             An AISSentence, holding the talker ('AI'), the
+                        sentence formatter ('VDM'), the fragment count and
+                        number, the sequential message ID, the channel, the
+                        armored payload and the number of fill bits
+    """
+
+    address, count, number, seq_id, channel, payload, fillbits = _fields(msg, ignore_crc)
+
+    return AISSentence(address[:2], address[2:], int(count), int(number), seq_id,
+                       channel, payload, int(fillbits) if fillbits else 0)
+
+
+def _fields(msg, ignore_crc):
+
+    """
+    Validates the structure and CRC of a sentence, see tokenize(), and returns
+    its 7 fields as strings, the first one being the address, e.g. 'AIVDM'
+    """
+
+    if not isinstance(msg, str):
+        return _bytes_fields(msg, ignore_crc)
+
+    msg = msg.rstrip()
+    star = len(msg) - 3
+
+    if star < 12 or msg[star] != "*" or msg[0] not in "!$":
+        raise ValueError("Malformed NMEA sentence.")
+
+    body = msg[1:star]
+    fields = body.split(",")
+
+    if len(fields) != 7 or len(fields[0]) != 5:
+        raise ValueError("Malformed NMEA sentence.")
+
+    if not ignore_crc and int(msg[star + 1:], 16) != _xor(body.encode("latin-1")):
+        raise CRCInvalidError("The given CRC did not match the computed CRC.")
+
+    return fields
+
+
+def _bytes_fields(msg, ignore_crc):
+
+    """
+    _fields() of a sentence given as bytes, bytearray or memoryview. The CRC
+    is computed over the bytes of the body as they are, only the body is
+    turned into a string to split it into fields
+    """
+
+    if isinstance(msg, memoryview):
+        msg = msg.tobytes()
+
+    msg = msg.rstrip()
+    star = len(msg) - 3
+
+    if star < 12 or msg[star] != 0x2a or msg[0] not in (0x21, 0x24):
+        raise ValueError("Malformed NMEA sentence.")
+
+    body = msg[1:star]
+    fields = body.decode("latin-1").split(",")
+
+    if len(fields) != 7 or len(fields[0]) != 5:
+        raise ValueError("Malformed NMEA sentence.")
+
+    if not ignore_crc and int(msg[star + 1:], 16) != _xor(body):
+        raise CRCInvalidError("The given CRC did not match the computed CRC.")
+
+    return fields
+
+
+def decode(msg, ignore_crc = False, lazy = False, where = None):
+
+    """
+    Decodes an AIS NMEA formatted message. Currently supports message 
+    types 1, 2, 3, 5, 8, 21 and 24. On success, returns an instance of 
+    the matching AISMessage sub-class. A CRC check is performed. If the CRC
+    does not match, a CRCInvalidError exception is thrown. Other message
+    types raise an UnsupportedMessageError exception and fragments of
+    multi-sentence messages a FragmentError exception, see AISReassembler
+
+    @param  msg     The message to decode, as a string or as bytes, bytearray
+                    or memoryview
+    @param  lazy    Decode the message elements on first access, see
+                    decode_payload()
+    @param  where   Optional AISFilter. Rejected messages are not decoded
+    @return         If CRC checks, returns an instance of AISMessage, or None
+                    if rejected by the filter
+    """
+
+    if where is not None and not where.match(msg):
+        return None
+
+    if stats is not None:
+        return stats.call("decode", _decode, (msg, ignore_crc, lazy))
+
+    return _decode(msg, ignore_crc, lazy)
+
+
+def _decode(msg, ignore_crc, lazy):
+    fields = _fields(msg, ignore_crc)
+
+    if fields[1] != "1":
+        raise FragmentError("Multi-fragment sentence, use AISReassembler to decode it.")
+
+    return decode_payload(fields[5], int(fields[6]) if fields[6] else 0, lazy)
+
+
+def decode_payload(payload, fillbits = 0, lazy = False):
+
+    """
+    Decodes an armored AIS payload, field 6 of the NMEA sentence, into an
+    instance of the matching AISMessage sub-class
+
+    @param  payload     The armored payload string
+    @param  fillbits    Number of fill bits, field 7 of the NMEA sentence
+    @param  lazy        Only de-armor the message header (id, repeat, mmsi)
+                        now. The other elements are decoded the first time
+                        one of them is accessed, invalid payload characters
+                        are only reported then
+    @return             An instance of AISMessage
+    """
+
+    # A lazy message only de-armors the 7 characters holding its header.
+    # These also hold the type 24 part number
+    lazy = lazy and len(payload) > 7
+
+    # De-armor the payload straight into one integer holding the message
+    # bits, then dispatch on the message id held in its top 6 bits
+    if lazy:
+        value, length = dearmor(payload[:7])
+    else:
+        value, length = dearmor(payload, fillbits)
+
+    if length < 6:
+        raise UnsupportedMessageError("Empty AIS payload.")
+
+    aisclass = _message_class(value, length)
+
+    if lazy:
+        return aisclass.from_payload(payload, fillbits, {
+                'id'        : value >> 36,
+                'repeat'    : (value >> 34) & 0x3,
+                'mmsi'      : (value >> 4) & 0x3fffffff
+            })
+
+    return aisclass.from_bits(value, length)
+
+
+def decode_bits(value, length):
+
+    """
+    Decodes the message bits, as returned by AISMessage.pack(), into an
+    instance of the matching AISMessage sub-class
+
+    @param  value   Integer holding the message bits
+    @param  length  Number of bits
+    @return         An instance of AISMessage
+    """
+
+    if length < 6:
+        raise UnsupportedMessageError("Empty AIS payload.")
+
+    return _message_class(value, length).from_bits(value, length)
+
+
+def _message_class(value, length):
+
+    """
+    Returns the AISMessage sub-class of the message bits, dispatching on the
+    message id held in their top 6 bits
+    """
+
+    msgId = value >> (length - 6)
+
+    if msgId == 24:
+        # Part number, bits 38-39, tells format A and B apart
+        partno = (value >> (length - 40)) & 0x3 if length >= 40 else 0
+        aisclass = AISStaticDataReportBMessage if partno == 1 else AISStaticDataReportAMessage
+    else:
+        aisclass = message_types.get(msgId)
+
+    if aisclass is None:
+        raise UnsupportedMessageError("Unsupported AIS message type %d." % msgId)
+
+    return aisclass
+
+
+def decode_header(msg, ignore_crc = False):
+
+    """
+    Decodes only the header of an AIS NMEA formatted message, without
+    creating a message object. The header is the same for every message type,
+    so this also works for types not supported by decode(). A CRC check is
+    performed, as in decode()
+
+    @param  msg     The message to decode. For multi-sentence messages this
+                    must be the first fragment
+    @return         Tuple (message id, repeat indicator, mmsi)
+    """
+
+    fields = _fields(msg, ignore_crc)
+
+    if fields[2] != "1":
+        raise FragmentError("Only the first fragment holds the message header.")
+
+    return payload_header(fields[5])
+
+
+def payload_header(payload):
+
+    """
+    Returns the (message id, repeat indicator, mmsi) header of an armored AIS
+    payload, de-armoring only its first 7 characters
+    """
+
+    value, length = dearmor(payload[:7])
+
+    if length < 42:
+        raise ValueError("AIS payload too short to hold a header.")
+
+    return value >> 36, (value >> 34) & 0x3, (value >> 4) & 0x3fffffff
+
+
+class AISFilter(object):
+
+    """
+    Selection of the sentences to decode, by message id, MMSI and radio
+    channel. The selection is checked on the raw sentence: the message id is
+    held in the first armored payload character and the MMSI in the first
+    seven, so rejected sentences are neither checksummed, de-armored nor
+    turned into messages:
+
+        where = AISFilter(types=(1, 2, 3), mmsi=range(237000000, 238000000))
+        for aismsg in decode_stream(feed, where=where):
+            ...
+
+    Each criterion is None, to accept any value, or a container of the
+    accepted values, such as a set or a range. Only the first fragment of a
+    multi-sentence message holds the message id and MMSI. Rejected sentences
+    are passed to AISReassembler.skip(), so the continuation fragments of
+    rejected messages are dropped quietly. Malformed sentences are accepted,
+    so they are reported by the decoder.
+    """
+
+    def __init__(self, types = None, mmsi = None, channels = None):
+        self.types = None if types is None else frozenset(types)
+        self.mmsi = mmsi
+        self.channels = None if channels is None else frozenset(channels)
+
+        # The message id is held in the first armored character of the payload
+        self._chars = None if types is None else frozenset(encodingchars[t] for t in self.types)
+
+        # Same for sentences given as bytes
+        self._bytes = (
+            None if self.channels is None else frozenset(c.encode("latin-1") for c in self.channels),
+            None if self._chars is None else frozenset(c.encode("latin-1") for c in self._chars))
+
+
+    def match(self, msg):
+        """
+        Returns False if the AIS NMEA formatted sentence, a string or a
+        bytes-like object, is rejected
+        """
+        if isinstance(msg, str):
+            one, channels, chars = "1", self.channels, self._chars
+            fields = msg.split(",", 6)
+        else:
+            one, (channels, chars) = b"1", self._bytes
+            fields = bytes(msg).split(b",", 6)
+
+        if len(fields) < 7:
+            return True
+
+        if channels is not None and fields[4] not in channels:
+            return False
+
+        if fields[2] != one:
+            return True
+
+        payload = fields[5]
+
+        if chars is not None and payload[:1] not in chars:
+            return False
+
+        if self.mmsi is not None and len(payload) >= 7:
+            try:
+                value, length = dearmor(payload[:7])
+            except ValueError:
+                return True
+
+            if (value >> 4) & 0x3fffffff not in self.mmsi:
+                return False
+
+        return True
+
+
+    def __repr__(self):
+        return "AISFilter(types=%r, mmsi=%r, channels=%r)" % (
+            self.types and sorted(self.types), self.mmsi, self.channels and sorted(self.channels))
+
+
+
+def _where(types, where):
+
+    """
+    Returns the AISFilter selecting both the given message ids and the given
+    AISFilter, either of which may be None
+    """
+
+    if types is None:
+        return where
+
+    if where is None:
+        return AISFilter(types = types)
+
+    if where.types is not None:
+        types = where.types.intersection(types)
+
+    return AISFilter(types, where.mmsi, where.channels)
+
+
+
+class AISDeduplicator(object):
+
+    """
+    Suppresses the repeats of a message heard by several receivers of a
+    merged feed. A message is a repeat when the same payload and fill bits
+    were seen within the last window seconds.
+
+    The hashes of the payloads seen are kept in a ring of sets, each covering
+    window / buckets seconds. Sets older than the window are dropped whole,
+    so each check is O(1) and memory only holds one window of messages,
+    capped at max_size hashes. Messages received out of order are recorded
+    in the set of their own time. Repeats are counted in 'duplicates'.
+
+    Pass an instance to AISReassembler to drop repeats before they are
+    decoded:
+
+        reassembler = AISReassembler(dedup=AISDeduplicator(window=10))
+        for aismsg in decode_stream(merged_feed, reassembler=reassembler):
+            ...
+    """
+
+    def __init__(self, window = 30, buckets = 6, max_size = 1000000, clock = time.time):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1.")
+
+        self.window = window
+        self.buckets = buckets
+        self.max_size = max_size
+        self.duplicates = 0
+        self._clock = clock
+        self._span = float(window) / buckets
+        self._size = 0
+
+        # [bucket number, set of hashes], oldest first
+        self._ring = collections.deque()
+
+
+    def __len__(self):
+        return self._size
+
+
+    def seen(self, payload, fillbits = 0, now = None):
+        """
+        Returns True if the message was seen within the window, otherwise
+        records it and returns False
+
+        @param  payload     The armored payload string, field 6 of the NMEA
+                            sentence, or the joined payloads of a multi-sentence
+                            message
+        @param  fillbits    Number of fill bits
+        @param  now         Time the message was received, defaults to the clock
+        """
+        if now is None:
+            now = self._clock()
+
+        key = hash(payload) ^ fillbits
+        bucket = int(now // self._span)
+        ring = self._ring
+
+        # Buckets expire relative to the latest time seen, even when messages
+        # are received out of order
+        latest = max(bucket, ring[-1][0]) if ring else bucket
+
+        while ring and ring[0][0] <= latest - self.buckets:
+            self._size -= len(ring.popleft()[1])
+
+        for number, hashes in ring:
+            if key in hashes:
+                self.duplicates += 1
+                return True
+
+        if not ring or ring[-1][0] < bucket:
+            ring.append([bucket, set()])
+            entry = ring[-1]
+        elif ring[-1][0] == bucket:
+            entry = ring[-1]
+        elif bucket <= ring[-1][0] - self.buckets:
+            # Received out of order and already out of the window
+            return False
+        else:
+            # Received out of order, recorded in the bucket of its own time
+            # so it expires with it
+            i = len(ring)
+
+            while i and ring[i - 1][0] > bucket:
+                i -= 1
+
+            if i and ring[i - 1][0] == bucket:
+                entry = ring[i - 1]
+            else:
+                entry = [bucket, set()]
+                ring.insert(i, entry)
+
+        while self._size >= self.max_size:
+            if ring[0] is not entry:
+                self._size -= len(ring.popleft()[1])
+            else:
+                # The bucket alone is full, start it over
+                self._size -= len(entry[1])
+                entry[1].clear()
+
+        entry[1].add(key)
+        self._size += 1
+
+        return False
+
+
+
+class AISReassembler(object):
+
+    """
+    Reassembles AIS messages split over several NMEA sentences, such as type 5
+    messages, before decoding them.
+
+    Pending fragments are kept per (source, talker, sequence id, channel) in a
+    table bounded to max_pending messages. Messages not completed within
+    timeout seconds of their first fragment, and the oldest messages once the
+    table is full, are evicted. Out of order and orphaned fragments are
+    dropped. The number of dropped messages and fragments is kept in the
+    'dropped' attribute. Each fragment costs O(1).
+
+    If an AISDeduplicator is given, repeats of complete messages are dropped
+    before being decoded. Multi-sentence messages are checked once joined, as
+    the fragments of one message may come from different receivers.
+
+    Messages whose first fragment was rejected by a filter, see skip(), are
+    kept pending without their payloads, so their continuation fragments
+    are dropped without being counted.
+    """
+
+    def __init__(self, max_pending = 1024, timeout = 60, clock = time.time, dedup = None):
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.dedup = dedup
+        self.dropped = 0
+        self._clock = clock
+
+        # key -> [first fragment time, fragment count, [payloads]], oldest
+        # first. The payloads are None for messages skipped by a filter
+        self._pending = collections.OrderedDict()
+
+
+    def __len__(self):
+        return len(self._pending)
+
+
+    def add(self, msg, source = None, ignore_crc = False, lazy = False):
+        """
+        Adds an AIS NMEA formatted sentence. Single sentence messages are
+        decoded straight away.
+
+        @param  msg         The sentence to add
+        @param  source      Optional identifier of the receiver the sentence
+                            came from, keeping fragments of different feeds apart
+        @param  ignore_crc  Do not check the CRC of the sentence
+        @param  lazy        Decode the message elements on first access, see
+                            decode_payload()
+        @return             An instance of AISMessage when the sentence completes
+                            a message, otherwise None
+        """
+
+        if stats is not None:
+            return stats.call("decode", self._add, (msg, source, ignore_crc, lazy))
+
+        return self._add(msg, source, ignore_crc, lazy)
+
+
+    def skip(self, msg, source = None):
+        """
+        Notes a sentence rejected by a filter. If it is the first fragment of
+        a multi-sentence message, the following fragments of the message are
+        dropped quietly, rather than counted as orphans in 'dropped'
+
+        @param  msg     The rejected sentence, as a string or as bytes
+        @param  source  Identifier of the receiver, see add()
+        """
+        # Single sentence messages, '!AIVDM,1,...', are all that most skipped
+        # sentences are
+        if msg[7:9] in ("1,", b"1,"):
+            return
+
+        if isinstance(msg, str):
+            fields = msg.split(",", 5)
+        else:
+            fields = [f.decode("latin-1") for f in bytes(msg).split(b",", 5)]
+
+        if len(fields) < 6 or fields[2] != "1" or fields[1] in ("", "1"):
+            return
+
+        try:
+            count = int(fields[1])
+        except ValueError:
+            return
+
+        key = (source, fields[0].strip()[1:], fields[3], fields[4])
+        pending = self._pending
+
+        now = self._clock()
+        self._expire(now)
+
+        entry = pending.pop(key, None)
+
+        if entry is not None and entry[2] is not None:
+            self._drop()
+
+        pending[key] = [now, count, None]
+
+        if len(pending) > self.max_pending and pending.popitem(last = False)[1][2] is not None:
+            self._drop()
+
+
+    def _add(self, msg, source, ignore_crc, lazy):
+        fields = _fields(msg, ignore_crc)
+        count, num, seq, channel, payload, fillbits = fields[1:7]
+
+        if count == "1":
+            fillbits = int(fillbits) if fillbits else 0
+
+            if self.dedup is not None and self.dedup.seen(payload, fillbits):
+                return None
+
+            return decode_payload(payload, fillbits, lazy)
+
+        count = int(count)
+        num = int(num)
+        key = (source, fields[0], seq, channel)
+        pending = self._pending
+
+        now = self._clock()
+        self._expire(now)
+
+        if num == 1:
+            # A first fragment restarts any message pending under the same key
+            entry = pending.pop(key, None)
+
+            if entry is not None and entry[2] is not None:
+                self._drop()
+
+            pending[key] = [now, count, [payload]]
+
+            if len(pending) > self.max_pending and pending.popitem(last = False)[1][2] is not None:
+                self._drop()
+
+            return None
+
+        entry = pending.get(key)
+
+        if entry is not None and entry[2] is None:
+            # Continuation of a message skipped by a filter
+            if num >= entry[1]:
+                del pending[key]
+
+            return None
+
+        if entry is None or entry[1] != count or len(entry[2]) != num - 1:
+            if entry is not None:
+                del pending[key]
+            self._drop()
+            return None
+
+        entry[2].append(payload)
+
+        if num < count:
+            return None
+
+        del pending[key]
+
+        payload = "".join(entry[2])
+        fillbits = int(fillbits) if fillbits else 0
+
+        if self.dedup is not None and self.dedup.seen(payload, fillbits):
+            return None
+
+        return decode_payload(payload, fillbits, lazy)
+
+
+    def _drop(self):
+        """
+        Counts a dropped message or fragment, also as a fragment error of the
+        instrumentation if enabled
+        """
+        self.dropped += 1
+
+        if stats is not None:
+            stats.error_counts['fragment'] += 1
+
+
+    def _expire(self, now):
+        """
+        Evicts the pending messages whose first fragment is older than the
+        timeout. The table is ordered by first fragment time.
+        """
+        pending = self._pending
+
+        while pending:
+            entry = next(iter(pending.values()))
+
+            if now - entry[0] <= self.timeout:
+                break
+
+            pending.popitem(last = False)
+
+            if entry[2] is not None:
+                self._drop()
+
+
+def decode_stream(lines, ignore_crc = False, skip_invalid = False, types = None,
+                  reassembler = None, lazy = False, where = None):
+
+    """
+    Generator decoding an iterable of AIS NMEA formatted messages, such as an
+    open file, a socket reader or another generator. Messages are decoded
+    lazily, one line at a time, so memory use does not grow with the input.
+    Blank lines are skipped and surrounding whitespace is ignored.
+
+    @param  lines           Iterable of NMEA sentences, as strings or
+                            bytes-like objects
+    @param  ignore_crc      Do not check the CRC of the sentences
+    @param  skip_invalid    Skip sentences which fail the CRC check, are
+                            malformed or are of an unsupported type, instead
+                            of raising an exception
+    @param  types           Optional collection of message ids. Sentences of
+                            other types are skipped before being decoded
+    @param  reassembler     AISReassembler used to join multi-sentence
+                            messages. A new one is used by default
+    @param  lazy            Decode the message elements on first access, see
+                            decode_payload()
+    @param  where           Optional AISFilter. Rejected sentences are skipped
+                            before being decoded
+    @return                 Generator of AISMessage instances
+    """
+
+    match = None if types is None and where is None else _where(types, where).match
+    errors = (CRCInvalidError, UnsupportedMessageError, ValueError, IndexError)
+    reassembler = reassembler if reassembler is not None else AISReassembler()
+    add, skip = reassembler.add, reassembler.skip
+
+    for line in lines:
+        if isinstance(line, memoryview):
+            line = line.tobytes()
+
+        line = line.strip()
+
+        if not line:
+            continue
+
+        if match is not None and not match(line):
+            skip(line)
+            continue
+
+        try:
+            aismsg = add(line, ignore_crc = ignore_crc, lazy = lazy)
+        except errors:
+            if skip_invalid:
+                continue
+            raise
+
+        if aismsg is not None:
+            yield aismsg
+
+
+def decode_file(path, workers = None, chunk_size = 1 << 23, ignore_crc = False,
+                skip_invalid = False, types = None, ordered = True, where = None):
+
+    """
+    Decodes a file of AIS NMEA formatted messages in parallel. The file is
+    memory mapped and split into line aligned byte ranges of about chunk_size
+    bytes, each decoded by decode_stream() in a pool of worker processes.
+    Ranges never end while a multi-sentence message is incomplete, even with
+    the fragments of several messages interleaved, so messages are not split
+    between workers.
+
+    @param  path            Path of the file to decode
+    @param  workers         Number of worker processes, defaults to the number
+                            of CPUs. With 1 the file is decoded in this process
+    @param  chunk_size      Approximate size in bytes of the ranges
+    @param  ordered         Yield the messages in file order. Otherwise the
+                            messages of each range are yielded as soon as it
+                            is decoded
+    @return                 Generator of AISMessage instances
+
+    See decode_stream() for the other parameters.
+    """
+
+    options = (ignore_crc, skip_invalid, _where(types, where))
+    tasks = [(path, start, end) + options for start, end in _split_file(path, chunk_size)]
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            for aismsg in _decode_range(task):
+                yield aismsg
+        return
+
+    pool = multiprocessing.Pool(min(workers, len(tasks)))
+
+    try:
+        batches = pool.imap(_decode_range, tasks) if ordered \
+                    else pool.imap_unordered(_decode_range, tasks)
+
+        for batch in batches:
+            for aismsg in batch:
+                yield aismsg
+
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _split_file(path, chunk_size, lookback = 4096, max_lines = 1000):
+
+    """
+    Returns the (start, end) byte ranges decode_file() splits the file into.
+    Range ends are moved forward to the first line at which no multi-sentence
+    message is open, found by following the fragments from lookback bytes
+    before the end. Messages still incomplete max_lines lines after their
+    first fragment are taken to be truncated.
+    """
+
+    with open(path, "rb") as f:
+        f.seek(0, 2)
+        size = f.tell()
+
+        if size == 0:
+            return []
+
+        mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+    try:
+        ranges = []
+        start = 0
+
+        while start < size:
+            end = start + chunk_size
+
+            if end < size:
+                end = _range_end(mm, size, max(start, end - lookback), end, max_lines)
+
+            end = min(end, size)
+            ranges.append((start, end))
+            start = end
+
+        return ranges
+    finally:
+        mm.close()
+
+
+def _range_end(mm, size, pos, end, max_lines):
+
+    """
+    Returns the start of the first line at or after end at which no
+    multi-sentence message is open, following the fragments from the line
+    holding pos
+    """
+
+    pos = mm.rfind(b"\n", 0, pos) + 1
+
+    # (address, sequence id, channel) -> (fragment count, line number of the
+    # first fragment), of the open messages
+    open_messages = {}
+    line = 0
+
+    while pos < size:
+        if pos >= end and not open_messages:
+            return pos
+
+        nl = mm.find(b"\n", pos)
+        nl = size if nl == -1 else nl + 1
+        fields = mm[pos:min(nl, pos + 32)].split(b",", 5)
+        pos = nl
+        line += 1
+
+        if len(fields) < 6 or fields[1] in (b"1", b""):
+            continue
+
+        key = (fields[0], fields[3], fields[4])
+
+        if fields[2] == b"1":
+            open_messages[key] = (fields[1], line)
+        elif fields[1] == fields[2] or key in open_messages and open_messages[key][0] != fields[1]:
+            open_messages.pop(key, None)
+
+        if open_messages and pos >= end:
+            for key in [k for k, v in open_messages.items() if line - v[1] > max_lines]:
+                del open_messages[key]
+
+    return size
+
+
+def _decode_range(task):
+
+    """
+    Worker of decode_file(), decodes one byte range of the file
+    """
+
+    path, start, end, ignore_crc, skip_invalid, where = task
+
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+    try:
+        lines = mm[start:end].splitlines()
+    finally:
+        mm.close()
+
+    return list(decode_stream(lines, ignore_crc, skip_invalid, where = where))
+
+
+# Columns of the array returned by decode_positions()
+position_dtype = [
+    ('id', 'u1'), ('mmsi', 'u4'), ('status', 'u1'), ('rot', 'i1'), ('sog', 'u2'),
+    ('lon', 'i4'), ('lat', 'i4'), ('cog', 'u2'), ('heading', 'u2'), ('ts', 'u1'),
+    ('raim', 'u1')
+]
+
+
+def decode_positions(lines, ignore_crc = False):
+
+    """
+    Decodes the type 1, 2 and 3 position reports of an iterable of AIS NMEA
+    formatted messages into a numpy structured array, one row per report and
+    one column per element of position_dtype. Other message types, fragments
+    and sentences failing the CRC check are skipped.
+
+    The payloads are de-armored in bulk and the elements extracted with
+    vectorized shifts and masks, using the AISPositionReportMessage layout.
+    Requires numpy.
+
+    @param  lines       Iterable of NMEA sentences, as strings or bytes-like
+                        objects
+    @param  ignore_crc  Do not check the CRC of the sentences
+    @return             numpy structured array of dtype position_dtype
+    """
+
+    if numpy is None:
+        raise ImportError("decode_positions() requires numpy.")
+
+    layout = AISPositionReportMessage._layout
+    nchars = layout.length // 6
+    bodies = []
+    payloads = []
+    checksums = []
+
+    # Pick the single sentence position reports, the only per line work done
+    # in Python
+    for line in lines:
+        if not isinstance(line, str):
+            line = bytes(line).decode("latin-1")
+
+        line = line.strip()
+        fields = line.split(",")
+
+        # Same framing as _fields(): '!' or '$', a 5 character address and
+        # the checksum after the '*' ending the fill bits field
+        if len(fields) != 7 or fields[1] != "1" or fields[6][:2] != "0*" or \
+                len(fields[6]) != 4 or len(fields[0]) != 6 or line[0] not in "!$":
+            continue
+
+        payload = fields[5]
+
+        if len(payload) != nchars or payload[0] not in "123":
+            continue
+
+        payloads.append(payload)
+
+        if not ignore_crc:
+            bodies.append(line[1:-3])
+            checksums.append(line[-2:])
+
+    count = len(payloads)
+    result = numpy.zeros(count, dtype = position_dtype)
+
+    if count == 0:
+        return result
+
+    # De-armor, rows of nchars 6-bit values
+    chars = numpy.frombuffer("".join(payloads).encode("ascii", "replace"),
+                             dtype = numpy.uint8).reshape(count, nchars)
+    valid = (((chars >= 48) & (chars <= 87)) | ((chars >= 96) & (chars <= 119))).all(axis = 1)
+    values = chars - numpy.uint8(48)
+    values = numpy.where(values > 40, values - numpy.uint8(8), values)
+
+    if not ignore_crc:
+        width = max(len(b) for b in bodies)
+        raw = numpy.frombuffer("".join(b.ljust(width, "\0") for b in bodies).encode("ascii", "replace"),
+                               dtype = numpy.uint8).reshape(count, width)
+        computed = numpy.bitwise_xor.reduce(raw, axis = 1)
+        given = numpy.array([_hex_byte(c) for c in checksums], dtype = numpy.int16)
+        valid &= computed == given
+
+    # Pack each row into 60-bit words of 10 characters each
+    nwords = -(-nchars // 10)
+    padded = numpy.zeros((count, nwords * 10), dtype = numpy.uint64)
+    padded[:, :nchars] = values & 0x3f
+    padded = padded.reshape(count, nwords, 10)
+    words = numpy.zeros((count, nwords), dtype = numpy.uint64)
+
+    for k in range(10):
+        words |= padded[:, :, k] << numpy.uint64(6 * (9 - k))
+
+    for name, shift, mask, sign in layout._specs:
+        if name not in result.dtype.names:
+            continue
+
+        nbits = mask.bit_length()
+        start = layout.length - shift - nbits
+        column = _extract_bits(words, start, nbits).astype(numpy.int64)
+
+        if sign:
+            column = (column ^ sign) - sign
+
+        result[name] = column
+
+    return result[valid]
+
+
+def encode_positions(columns = None, channel = "A", **elements):
+
+    """
+    Encodes many type 1, 2 or 3 position reports at once into single
+    sentence NMEA messages, in one vectorized pass. Element values are given
+    as numpy arrays, sequences or scalars, which are broadcast against each
+    other. Missing elements take the AISPositionReportMessage defaults.
+    Requires numpy.
+
+        sentences = encode_positions(mmsi=mmsis, lat=lats, lon=lons, sog=sogs)
+
+    @param  columns     Optional structured array, such as returned by
+                        decode_positions(), or dict of element columns
+    @param  channel     Radio channel code of the sentences
+    @param  elements    Element columns, overriding those of columns
+    @return             List of NMEA sentences, identical to those of
+                        AIS.build_payload()
+    """
+
+    if numpy is None:
+        raise ImportError("encode_positions() requires numpy.")
+
+    values = {}
+
+    if columns is not None:
+        names = columns.dtype.names if hasattr(columns, "dtype") else list(columns.keys())
+        values.update((name, columns[name]) for name in names)
+
+    values.update(elements)
+
+    layout = AISPositionReportMessage._layout
+
+    for name in values:
+        if name not in layout.bitmap:
+            raise ValueError("Unsupported AIS message element '%s'." % name)
+
+    default = AISPositionReportMessage()
+    arrays = []
+
+    for name in layout.names:
+        column = numpy.asarray(values.get(name, getattr(default, name)))
+
+        # Like AISLayout.check(), only integers are accepted rather than
+        # truncating floats. Empty sequences are of dtype float
+        if column.size and not numpy.issubdtype(column.dtype, numpy.integer):
+            raise TypeError("Values of element '%s' must be integers." % name)
+
+        arrays.append(column)
+
+    arrays = numpy.broadcast_arrays(*arrays)
+    count = arrays[0].size
+
+    # Set the bits of every element in rows of left aligned 60-bit words
+    nchars = -(-layout.length // 6)
+    nwords = -(-nchars // 10)
+    fillbits = nchars * 6 - layout.length
+    words = numpy.zeros((count, nwords), dtype = numpy.uint64)
+
+    for (name, dtype, nbits), (_, shift, mask, sign), column in zip(layout.fields, layout._specs, arrays):
+        column = column.ravel()
+
+        if dtype == "int":
+            lo, hi = -(1 << (nbits - 1)), (1 << (nbits - 1)) - 1
+        else:
+            lo, hi = 0, (1 << nbits) - 1
+
+        if count and (column.min() < lo or column.max() > hi):
+            raise ValueError("Value out of range for %s:%d element '%s'." % (dtype, nbits, name))
+
+        start = layout.length - shift - nbits
+        _insert_bits(words, start, nbits, column.astype(numpy.uint64) & numpy.uint64(mask))
+
+    # Armor the 6-bit characters
+    sixbits = numpy.empty((count, nwords, 10), dtype = numpy.uint64)
+
+    for k in range(10):
+        sixbits[:, :, k] = (words >> numpy.uint64(6 * (9 - k))) & numpy.uint64(0x3f)
+
+    alphabet = numpy.frombuffer("".join(encodingchars).encode("ascii"), dtype = numpy.uint8)
+    payloads = alphabet[sixbits.reshape(count, nwords * 10)[:, :nchars]]
+
+    # Assemble the sentences and their checksums
+    head = "!AIVDM,1,1,,%s," % channel
+    tail = ",%d*" % fillbits
+    width = len(head) + nchars + len(tail) + 2
+    chksum = numpy.bitwise_xor.reduce(payloads, axis = 1) ^ numpy.uint8(crc(head[1:] + tail[:-1]))
+    hexdigits = numpy.frombuffer(b"0123456789ABCDEF", dtype = numpy.uint8)
+
+    out = numpy.empty((count, width), dtype = numpy.uint8)
+    out[:, :len(head)] = numpy.frombuffer(head.encode("ascii"), dtype = numpy.uint8)
+    out[:, len(head):len(head) + nchars] = payloads
+    out[:, len(head) + nchars:-2] = numpy.frombuffer(tail.encode("ascii"), dtype = numpy.uint8)
+    out[:, -2] = hexdigits[chksum >> 4]
+    out[:, -1] = hexdigits[chksum & 0xf]
+
+    text = out.tobytes().decode("ascii")
+
+    return [text[i:i + width] for i in range(0, len(text), width)]
+
+
+def _insert_bits(words, start, nbits, column):
+
+    """
+    Sets the bits [start, start + nbits) of rows of left aligned 60-bit words
+    to column, as used by encode_positions()
+    """
+
+    end = start + nbits
+    first, last = start // 60, (end - 1) // 60
+
+    if first == last:
+        words[:, first] |= column << numpy.uint64(60 * (first + 1) - end)
+        return
+
+    low_bits = end - 60 * last
+    words[:, first] |= column >> numpy.uint64(low_bits)
+    words[:, last] |= (column & numpy.uint64((1 << low_bits) - 1)) << numpy.uint64(60 - low_bits)
+
+
+def _hex_byte(text):
+    try:
+        return int(text, 16) if len(text) == 2 else -1
+    except ValueError:
+        return -1
+
+
+def _extract_bits(words, start, nbits):
+
+    """
+    Extracts the bits [start, start + nbits) of rows of left aligned 60-bit
+    words, as used by decode_positions()
+    """
+
+    end = start + nbits
+    first, last = start // 60, (end - 1) // 60
+    mask = numpy.uint64((1 << nbits) - 1)
+
+    if first == last:
+        return (words[:, first] >> numpy.uint64(60 * (first + 1) - end)) & mask
+
+    low_bits = end - 60 * last
+    high = words[:, first] & numpy.uint64((1 << (60 * last - start)) - 1)
+    low = words[:, last] >> numpy.uint64(60 - low_bits)
+
+    return (high << numpy.uint64(low_bits)) | low
+
+
+def crc(msg):
+
+    """
+    Generates the CRC for the given AIS NMEA formatted string
+
+    @param  msg     The message used to generate the CRC. This should be
+                    a well formed NMEA formatted message, as a string or as
+                    bytes, bytearray or memoryview
+    @return         Integer representation of the CRC. You can use hex(crc)
+                    to get the hex
+    """
+
+    # Bytes-like messages are checksummed as they are
+    if isinstance(msg, str):
+        star, bang = "*", "!"
+    else:
+        if isinstance(msg, memoryview):
+            msg = msg.tobytes()
+        star, bang = b"*", b"!"
+
+    # If the input contains the entire NMEA message, then we just need to
+    # get the string between the ! and *
+    # Otherwise we'll assume the input contains just the string to checksum
+    astk = msg.rfind(star)
+
+    if msg[:1] == bang and astk != -1:
+        msg = msg[1:astk]
+
+    return _xor(msg.encode("latin-1") if star == "*" else msg)
+
+
+def _xor(data):
+
+    """
+    Returns the XOR of all the bytes of data. Iterating bytes yields ints,
+    which saves the ord() call per character of a loop over a str
+    """
+
+    chksum = 0
+
+    for c in data:
+        chksum ^= c
+
+    return chksum
+
+
+
+# Instrumentation of the decode and encode paths, see enable_stats(). While
+# disabled it is None, so the hot paths only test a module global
+stats = None
+
+
+class AISStats(object):
+
+    """
+    Counters and latency histograms of the decode, encode and build paths:
+
+        messages    operation -> message id -> count
+        errors      'crc', 'unsupported', 'fragment' and 'malformed' counts.
+                    'fragment' also counts the messages and fragments
+                    dropped by AISReassembler
+        latency     operation -> counts per bucket of the latency_buckets
+                    upper bounds, in seconds, the last one for anything slower.
+                    Only calls which return are timed
+
+    'decode' covers decode(), AIS.decode() and AISReassembler.add(), so also
+    decode_stream(), 'encode' covers AIS.encode() and 'build' covers
+    AIS.build_payload().
+    """
+
+    latency_buckets = (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3, 1e-2)
+
+    errors = (
+        (CRCInvalidError,           'crc'),
+        (UnsupportedMessageError,   'unsupported'),
+        (FragmentError,             'fragment'),
+        ((ValueError, IndexError),  'malformed')
+    )
+
+
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        """
+        Sets all counters to zero
+        """
+        self.messages = collections.defaultdict(collections.Counter)
+        self.error_counts = collections.Counter()
+        self.latency = collections.defaultdict(lambda: [0] * (len(self.latency_buckets) + 1))
+        self.latency_sum = collections.Counter()
+
+
+    def call(self, operation, func, args, aismsg = None):
+        """
+        Returns func(*args), counting the message, by the id of aismsg or
+        else of the returned message, the error raised and the latency
+        """
+        start = time.perf_counter()
+
+        try:
+            result = func(*args)
+        except Exception as e:
+            for error, name in self.errors:
+                if isinstance(e, error):
+                    self.error_counts[name] += 1
+                    break
+            raise
+
+        elapsed = time.perf_counter() - start
+        self.latency[operation][bisect.bisect_left(self.latency_buckets, elapsed)] += 1
+        self.latency_sum[operation] += elapsed
+
+        if aismsg is None:
+            aismsg = result
+
+        if aismsg is not None:
+            self.messages[operation][aismsg.id] += 1
+
+        return result
+
+
+    def snapshot(self):
+        """
+        Returns a copy of the counters as plain dicts and lists. Histograms
+        hold the cumulative (upper bound, count) of each bucket, the last
+        bound being float('inf').
+        """
+        bounds = self.latency_buckets + (float('inf'),)
+
+        return {
+            'messages'  : dict((op, dict(counts)) for op, counts in self.messages.items()),
+            'errors'    : dict((name, self.error_counts[name]) for error, name in self.errors),
+            'latency'   : dict((op, {
+                              'buckets' : list(zip(bounds, itertools.accumulate(counts))),
+                              'count'   : sum(counts),
+                              'sum'     : self.latency_sum[op]
+                          }) for op, counts in self.latency.items())
+        }
+
+
+    def prometheus(self, prefix = "aislib"):
+        """
+        Returns the counters in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP %s_messages_total Messages processed, by operation and message id" % prefix,
+            "# TYPE %s_messages_total counter" % prefix
+        ]
+
+        for op, counts in sorted(snapshot['messages'].items()):
+            for msgid, count in sorted(counts.items()):
+                lines.append('%s_messages_total{operation="%s",type="%d"} %d' % (prefix, op, msgid, count))
+
+        lines.append("# HELP %s_errors_total Sentences which failed to decode, by error" % prefix)
+        lines.append("# TYPE %s_errors_total counter" % prefix)
+
+        for name, count in sorted(snapshot['errors'].items()):
+            lines.append('%s_errors_total{error="%s"} %d' % (prefix, name, count))
+
+        lines.append("# HELP %s_latency_seconds Latency of the operations" % prefix)
+        lines.append("# TYPE %s_latency_seconds histogram" % prefix)
+
+        for op, histogram in sorted(snapshot['latency'].items()):
+            for bound, count in histogram['buckets']:
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append('%s_latency_seconds_bucket{operation="%s",le="%s"} %d' % (prefix, op, le, count))
+
+            lines.append('%s_latency_seconds_sum{operation="%s"} %r' % (prefix, op, histogram['sum']))
+            lines.append('%s_latency_seconds_count{operation="%s"} %d' % (prefix, op, histogram['count']))
+
+        return "\n".join(lines) + "\n"
+
+
+def enable_stats():
+
+    """
+    Enables the instrumentation, if not already, and returns the AISStats
+    instance counting the module activity
+    """
+
+    global stats
+
+    if stats is None:
+        stats = AISStats()
+
+    return stats
+
+
+def disable_stats():
+
+    """
+    Disables the instrumentation. Returns the AISStats instance, which keeps
+    its counters, or None if it was not enabled.
+    """
+
+    global stats
+
+    previous, stats = stats, None
+
+    return previous
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+
+"""
+Playback of vessel tracks as AIS NMEA sentences.
+
+Loads the tracks of any number of vessels and replays them from a single
+timeline of due reports, kept in a heap, so a whole port area is simulated
+by one process:
+
+    playback = AISPlayback(speed=60, itu_intervals=True)
+    playback.add(load_track("highspeed4.txt", 239658000))
+    asyncio.run(playback.play(print))
+
+Each vessel encodes its position reports with an aislib.AISPreparedMessage,
+so a report costs a few microseconds.
+
+This program is licensed under the GNU GENERAL PUBLIC LICENSE Version 2.
+A LICENSE file should have accompanied this program.
+"""
+
+import asyncio
+import calendar
+import heapq
+import time
+
+import aislib
+import aistdma
+
+
+
+def report_interval(sog, status = 0):
+
+    """
+    Returns the reporting interval in seconds of a Class A station, per
+    ITU-R M.1371, for the given speed in knots and navigational status.
+    Intervals shortened while changing course are not applied.
+    """
+
+    if status in (1, 5) and sog <= 3:
+        return 180
+    if sog <= 14:
+        return 10
+    if sog <= 23:
+        return 6
+
+    return 2
+
+
+def load_track(path, mmsi, **kwargs):
+
+    """
+    Loads a vessel track from a tab separated file, as exported by vessel
+    tracking sites, with columns:
+
+        Timestamp (UTC), AIS Source, Speed (kn), Latitude, Longitude, Course
+
+    Lines which can not be parsed, such as headers, are skipped.
+
+    @param  path    Path of the track file
+    @param  mmsi    MMSI of the vessel
+    @param  kwargs  Other AISTrack arguments
+    @return         AISTrack instance
+    """
+
+    points = []
+
+    with open(path, encoding = "latin-1") as f:
+        for line in f:
+            fields = line.split("\t")
+
+            try:
+                t = calendar.timegm(time.strptime(fields[0], "%Y-%m-%d %H:%M"))
+                points.append((t, float(fields[4]), float(fields[3]), float(fields[2]), float(fields[5])))
+            except (ValueError, IndexError):
+                continue
+
+    return AISTrack(mmsi, points, **kwargs)
+
+
+
+class AISTrack(object):
+
+    """
+    Track of one vessel: a time ordered list of (time, lon, lat, sog, cog)
+    points, time in seconds, positions in degrees, speed in knots and course
+    in degrees. Positions between points are interpolated linearly.
+
+    'static' is an optional list of sentences, such as a type 5 message,
+    broadcast when playback starts and every static_interval seconds after.
+
+    If 'station' is set to an aistdma.AISStation, each report carries the
+    communication state of the slot it is sent in, otherwise the fixed
+    comm_state.
+    """
+
+    def __init__(self, mmsi, points, static = None, status = 0, comm_state = 82419):
+        if not points:
+            raise ValueError("Track has no points.")
+
+        self.mmsi = mmsi
+        self.points = sorted(points)
+        self.static = static or []
+        self.status = status
+        self.start = self.points[0][0]
+        self.end = self.points[-1][0]
+        self.station = None
+
+        self._prepared = aislib.AISPreparedMessage(aislib.AISPositionReportMessage(
+            mmsi = mmsi, status = status, pa = 1, raim = 1, comm_state = comm_state))
+
+        # Index of the point at or before the last requested time. Playback
+        # times only increase, so lookups move it forward
+        self._cursor = 0
+
+
+    def position(self, t):
+        """
+        Returns the (lon, lat, sog, cog) of the vessel at the given time
+        """
+        points = self.points
+
+        if t < points[self._cursor][0]:
+            self._cursor = 0
+
+        while self._cursor + 1 < len(points) and points[self._cursor + 1][0] <= t:
+            self._cursor += 1
+
+        t0, lon0, lat0, sog, cog = points[self._cursor]
+
+        if self._cursor + 1 == len(points) or t <= t0:
+            return lon0, lat0, sog, cog
+
+        t1, lon1, lat1 = points[self._cursor + 1][:3]
+        k = (t - t0) / float(t1 - t0)
+
+        return lon0 + (lon1 - lon0) * k, lat0 + (lat1 - lat0) * k, sog, cog
+
+
+    def report(self, t):
+        """
+        Returns the position report sentence of the vessel at the given time
+        """
+        lon, lat, sog, cog = self.position(t)
+        elements = dict(
+            lon = int(lon * 600000),
+            lat = int(lat * 600000),
+            sog = min(int(sog * 10), 1022),
+            cog = int(cog * 10) % 3600,
+            heading = int(cog) % 360,
+            ts = int(t) % 60)
+
+        if self.station is not None:
+            elements['comm_state'] = self.station.transmit(t, report_interval(sog, self.status))
+
+        return self._prepared.build(**elements)
+
+
+    def next_report(self, t, itu_intervals = False):
+        """
+        Returns the time of the report following the one at time t, or None
+        past the end of the track. Reports follow the track points, or the
+        ITU reporting intervals if itu_intervals is set.
+        """
+        if itu_intervals:
+            t += report_interval(self.position(t)[2], self.status)
+        else:
+            self.position(t)
+            cursor = self._cursor + 1
+
+            if cursor == len(self.points):
+                return None
+
+            t = self.points[cursor][0]
+
+        return t if t <= self.end else None
+
+
+
+class AISPlayback(object):
+
+    """
+    Scheduler replaying any number of tracks on one timeline. Due reports
+    are kept in a heap ordered by time, so each report costs O(log n) for n
+    vessels whatever their reporting intervals.
+
+    Tracks are replayed on their own clock, starting at the earliest track
+    start, speed times faster than real time.
+
+    If an aistdma.AISSlotAllocator is given, each track added gets its own
+    SOTDMA station on it, so the reports of all vessels carry the
+    communication states of non-colliding slots.
+    """
+
+    def __init__(self, speed = 1.0, itu_intervals = False, static_interval = 360, slots = None):
+        self.speed = speed
+        self.itu_intervals = itu_intervals
+        self.static_interval = static_interval
+        self.slots = slots
+        self.emitted = 0
+        self._heap = []
+        self._counter = 0
+
+
+    def __len__(self):
+        return len(self._heap)
+
+
+    def add(self, track):
+        """
+        Schedules the reports of a track
+        """
+        if self.slots is not None and track.station is None:
+            track.station = aistdma.AISStation(self.slots)
+
+        if track.static:
+            self._push(track.start, track, True)
+
+        self._push(track.start, track, False)
+
+
+    def _push(self, t, track, static):
+        # The counter keeps equal times in order of scheduling
+        self._counter += 1
+        heapq.heappush(self._heap, (t, self._counter, track, static))
+
+
+    def events(self, until = None):
+        """
+        Generator of the (time, sentence) of the scheduled reports, in time
+        order, without waiting. Stops at the given time, if any.
+        """
+        heap = self._heap
+
+        while heap and (until is None or heap[0][0] <= until):
+            t, n, track, static = heapq.heappop(heap)
+
+            if static:
+                sentences = track.static
+
+                if t + self.static_interval <= track.end:
+                    self._push(t + self.static_interval, track, True)
+            else:
+                sentences = [track.report(t)]
+                due = track.next_report(t, self.itu_intervals)
+
+                if due is not None:
+                    self._push(due, track, False)
+
+            for sentence in sentences:
+                self.emitted += 1
+                yield t, sentence
+
+
+    async def play(self, emit, until = None):
+        """
+        Replays the scheduled reports in real time, scaled by the speed
+        factor, calling emit(sentence) for each. Reports due at the same
+        time are emitted together, with a single wait.
+        """
+        if not self._heap:
+            return
+
+        loop = asyncio.get_running_loop()
+        wall0 = loop.time()
+        sim0 = self._heap[0][0]
+
+        for t, sentence in self.events(until):
+            delay = wall0 + (t - sim0) / float(self.speed) - loop.time()
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            emit(sentence)
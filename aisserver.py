@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+"""
+asyncio ingest of AIS NMEA feeds.
+
+Accepts NMEA sentences from many receivers over UDP datagrams and TCP
+connections on a single event loop, decodes them with aislib and hands the
+decoded messages to a consumer through a bounded queue:
+
+    async def main():
+        ingest = AISIngest()
+        await ingest.serve_udp("0.0.0.0", 10110)
+        await ingest.serve_tcp("0.0.0.0", 10111)
+
+        async for aismsg in ingest.messages():
+            store.update(aismsg)
+
+    asyncio.run(main())
+
+This program is licensed under the GNU GENERAL PUBLIC LICENSE Version 2.
+A LICENSE file should have accompanied this program.
+"""
+
+import asyncio
+
+import aislib
+
+
+
+class AISIngest(object):
+
+    """
+    Decodes the sentences received by any number of UDP and TCP endpoints.
+
+    Messages decoded during one pass of the event loop are put on the queue
+    as a single batch, a list of AISMessage instances, so the consumer is
+    woken once per batch rather than once per sentence. A batch is also
+    flushed as soon as it holds batch_size messages.
+
+    The queue holds at most maxsize batches. When it is full, reading from
+    the TCP connections is paused until the consumer catches up. UDP can not
+    be paused, so sentences received over UDP meanwhile are dropped without
+    being decoded, and counted in 'dropped'.
+
+    Multi-sentence messages are reassembled per receiver, identified by its
+    address. Sentences which fail the CRC check, are malformed or are of an
+    unsupported type are counted in 'invalid' and skipped. Sentences rejected
+    by the optional aislib.AISFilter 'where' are skipped before being decoded.
+    """
+
+    # Longest line buffered from a TCP connection, in bytes
+    max_line = 4096
+
+    errors = (aislib.CRCInvalidError, aislib.UnsupportedMessageError, ValueError, IndexError)
+
+
+    def __init__(self, maxsize = 64, batch_size = 512, ignore_crc = False, lazy = False,
+                 reassembler = None, where = None):
+        self.queue = asyncio.Queue(maxsize)
+        self.batch_size = batch_size
+        self.ignore_crc = ignore_crc
+        self.lazy = lazy
+        self.where = where
+        self.reassembler = reassembler if reassembler is not None else aislib.AISReassembler()
+
+        self.received = 0
+        self.decoded = 0
+        self.invalid = 0
+        self.dropped = 0
+
+        self._pending = []
+        self._flush_handle = None
+        self._blocked = None
+        self._servers = []
+        self._endpoints = []
+        self._streams = set()
+
+
+    async def serve_udp(self, host, port):
+        """
+        Receives sentences in UDP datagrams on the given address
+
+        @return     The datagram transport
+        """
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: _DatagramProtocol(self), local_addr = (host, port))
+        self._endpoints.append(transport)
+
+        return transport
+
+
+    async def serve_tcp(self, host, port):
+        """
+        Accepts TCP connections sending newline separated sentences on the
+        given address
+
+        @return     The asyncio Server
+        """
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: _StreamProtocol(self), host, port)
+        self._servers.append(server)
+
+        return server
+
+
+    async def messages(self):
+        """
+        Async generator of the decoded messages, in order of reception
+        """
+        while True:
+            batch = await self.queue.get()
+
+            for aismsg in batch:
+                yield aismsg
+
+
+    def close(self):
+        """
+        Closes all endpoints and connections. Messages already queued are
+        kept.
+        """
+        for server in self._servers:
+            server.close()
+
+        for transport in self._endpoints + list(self._streams):
+            transport.close()
+
+        if self._blocked is not None:
+            self._blocked.cancel()
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush()
+
+        self._servers, self._endpoints = [], []
+
+
+    def feed(self, lines, source = None):
+        """
+        Decodes received sentences and adds the messages to the pending batch
+
+        @param  lines   Iterable of NMEA sentences, as strings or bytes-like
+                        objects
+        @param  source  Identifier of the receiver the sentences come from
+        """
+        add = self.reassembler.add
+        match = None if self.where is None else self.where.match
+        pending = self._pending
+
+        if self._blocked is not None:
+            # Waiting for the consumer, only UDP gets here. The lines would
+            # be dropped in _flush(), so they are not decoded
+            for line in lines:
+                if line.strip():
+                    self.received += 1
+                    self.dropped += 1
+            return
+
+        for line in lines:
+            if isinstance(line, memoryview):
+                line = line.tobytes()
+
+            line = line.strip()
+
+            if not line:
+                continue
+
+            self.received += 1
+
+            if match is not None and not match(line):
+                self.reassembler.skip(line, source)
+                continue
+
+            try:
+                aismsg = add(line, source = source, ignore_crc = self.ignore_crc, lazy = self.lazy)
+            except self.errors:
+                self.invalid += 1
+                continue
+
+            if aismsg is not None:
+                pending.append(aismsg)
+
+        if len(pending) >= self.batch_size:
+            self._flush()
+        elif pending and self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_soon(self._flush)
+
+
+    def _flush(self):
+        """
+        Puts the pending batch on the queue, or pauses the TCP connections if
+        the queue is full
+        """
+        self._flush_handle = None
+        batch, self._pending = self._pending, []
+
+        if not batch:
+            return
+
+        if self._blocked is not None:
+            # Decoded before the queue filled up
+            self.dropped += len(batch)
+            return
+
+        self.decoded += len(batch)
+
+        try:
+            self.queue.put_nowait(batch)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        for transport in self._streams:
+            transport.pause_reading()
+
+        self._blocked = asyncio.ensure_future(self._put(batch))
+
+
+    async def _put(self, batch):
+        try:
+            await self.queue.put(batch)
+        finally:
+            self._blocked = None
+
+        for transport in self._streams:
+            if not transport.is_closing():
+                transport.resume_reading()
+
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, ingest):
+        self.ingest = ingest
+
+
+    def datagram_received(self, data, addr):
+        self.ingest.feed(data.split(b"\n"), addr)
+
+
+
+class _StreamProtocol(asyncio.Protocol):
+
+    def __init__(self, ingest):
+        self.ingest = ingest
+        self.transport = None
+        self.source = None
+        self._buffer = b""
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.source = transport.get_extra_info("peername")
+        self.ingest._streams.add(transport)
+
+        if self.ingest._blocked is not None:
+            transport.pause_reading()
+
+
+    def connection_lost(self, exc):
+        self.ingest._streams.discard(self.transport)
+
+        if self._buffer:
+            self.ingest.feed([self._buffer], self.source)
+            self._buffer = b""
+
+
+    def data_received(self, data):
+        lines = (self._buffer + data).split(b"\n")
+        self._buffer = lines.pop()
+
+        if len(self._buffer) > self.ingest.max_line:
+            self.ingest.invalid += 1
+            self._buffer = b""
+
+        if lines:
+            self.ingest.feed(lines, self.source)
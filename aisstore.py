@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+
+"""
+Latest state of the vessels heard on an AIS feed.
+
+Keeps, per MMSI, the last position report and static data decoded by aislib,
+in bounded memory, and a grid index of the vessel positions for bounding box,
+radius and nearest neighbour queries.
+
+This program is licensed under the GNU GENERAL PUBLIC LICENSE Version 2.
+A LICENSE file should have accompanied this program.
+"""
+
+import collections
+import heapq
+import math
+import time
+
+import aislib
+
+
+
+class VesselRecord(object):
+
+    """
+    Latest known state of one vessel. Each attribute holds the last decoded
+    message of its kind, or None if none was heard yet:
+
+        position    type 1, 2 or 3 position report
+        voyage      type 5 static and voyage related data
+        static_a    type 24 part A static data report
+        static_b    type 24 part B static data report
+
+    'updated' is the time the vessel was last heard.
+    """
+
+    __slots__ = ('mmsi', 'position', 'voyage', 'static_a', 'static_b', 'updated')
+
+
+    def __init__(self, mmsi):
+        self.mmsi = mmsi
+        self.position = None
+        self.voyage = None
+        self.static_a = None
+        self.static_b = None
+        self.updated = None
+
+
+    def __repr__(self):
+        return "VesselRecord(mmsi=%d)" % self.mmsi
+
+
+
+class VesselStore(object):
+
+    """
+    Table of the latest state of every vessel, keyed by MMSI. Lookups and
+    updates are O(1).
+
+    The table is kept in least recently heard order. When max_vessels is set,
+    adding a vessel beyond it evicts the one heard least recently. When
+    max_age is set, vessels not heard for max_age seconds are evicted on
+    update and by expire().
+
+        store = VesselStore(max_vessels=200000, max_age=3600)
+
+        for aismsg in aislib.decode_stream(feed, skip_invalid=True):
+            store.update(aismsg)
+
+        record = store.get(237772000)
+
+    If a SpatialIndex is given, it is kept up to date with the position of
+    every vessel in the table.
+    """
+
+    # Maps message classes to the VesselRecord attribute they update
+    _slots = {
+        aislib.AISPositionReportMessage         : 'position',
+        aislib.AISStaticAndVoyageReportMessage  : 'voyage',
+        aislib.AISStaticDataReportAMessage      : 'static_a',
+        aislib.AISStaticDataReportBMessage      : 'static_b'
+    }
+
+
+    def __init__(self, max_vessels = None, max_age = None, clock = time.time, index = None):
+        self.max_vessels = max_vessels
+        self.max_age = max_age
+        self.index = index
+        self.evicted = 0
+        self._clock = clock
+        self._vessels = collections.OrderedDict()
+
+
+    def __len__(self):
+        return len(self._vessels)
+
+
+    def __contains__(self, mmsi):
+        return mmsi in self._vessels
+
+
+    def __iter__(self):
+        return iter(list(self._vessels.values()))
+
+
+    def get(self, mmsi):
+        """
+        Returns the VesselRecord of the given MMSI, or None if unknown
+        """
+        return self._vessels.get(mmsi)
+
+
+    def update(self, aismsg, now = None):
+        """
+        Updates the table with a decoded message. Messages other than position
+        reports and static data are ignored.
+
+        @param  aismsg  An instance of AISMessage
+        @param  now     Time the message was received, defaults to the clock
+        @return         The updated VesselRecord, or None if ignored
+        """
+        slot = self._slots.get(getattr(type(aismsg), '_base', type(aismsg)))
+
+        if slot is None:
+            return None
+
+        if now is None:
+            now = self._clock()
+
+        mmsi = aismsg.mmsi
+        vessels = self._vessels
+        record = vessels.get(mmsi)
+
+        if record is None:
+            record = vessels[mmsi] = VesselRecord(mmsi)
+
+            if self.max_vessels is not None and len(vessels) > self.max_vessels:
+                self._evict()
+        else:
+            vessels.move_to_end(mmsi)
+
+        setattr(record, slot, aismsg)
+        record.updated = now
+
+        if slot == 'position' and self.index is not None:
+            self.index.update(mmsi, aismsg.lon, aismsg.lat)
+
+        if self.max_age is not None:
+            self.expire(now)
+
+        return record
+
+
+    def expire(self, now = None):
+        """
+        Evicts the vessels not heard for max_age seconds
+
+        @return     Number of vessels evicted
+        """
+        if self.max_age is None:
+            return 0
+
+        if now is None:
+            now = self._clock()
+
+        vessels = self._vessels
+        count = 0
+
+        while vessels:
+            record = next(iter(vessels.values()))
+
+            if now - record.updated <= self.max_age:
+                break
+
+            self._evict()
+            count += 1
+
+        return count
+
+
+    def _evict(self):
+        """
+        Evicts the vessel heard least recently
+        """
+        mmsi, record = self._vessels.popitem(last = False)
+        self.evicted += 1
+
+        if self.index is not None:
+            self.index.remove(mmsi)
+
+
+
+# Position units of AISPositionReportMessage, 1/10000 minute, per degree
+UNITS_PER_DEGREE = 600000
+
+# Mean earth radius, in meters
+EARTH_RADIUS = 6371000.0
+
+
+def distance(lon1, lat1, lon2, lat2):
+
+    """
+    Returns the great circle distance in meters between two positions given
+    in 1/10000 minute, as in AISPositionReportMessage
+    """
+
+    k = math.pi / 180 / UNITS_PER_DEGREE
+    phi1, phi2 = lat1 * k, lat2 * k
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin((lon2 - lon1) * k / 2) ** 2
+
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+
+class SpatialIndex(object):
+
+    """
+    Grid index of the latest position of each vessel, in the 1/10000 minute
+    units of AISPositionReportMessage. Positions are bucketed in square cells
+    of cell_size units (0.1 degree by default), so updates are O(1) and
+    queries only look at the cells they overlap.
+
+    Positions outside the valid range, such as the 'not available' values
+    181 and 91 degrees, are not indexed.
+    """
+
+    def __init__(self, cell_size = UNITS_PER_DEGREE // 10):
+        self.cell_size = cell_size
+
+        # mmsi -> (lon, lat, cell)
+        self._positions = {}
+
+        # cell -> set of mmsi
+        self._cells = {}
+
+
+    def __len__(self):
+        return len(self._positions)
+
+
+    def __contains__(self, mmsi):
+        return mmsi in self._positions
+
+
+    def get(self, mmsi):
+        """
+        Returns the indexed (lon, lat) of the given MMSI, or None
+        """
+        position = self._positions.get(mmsi)
+
+        return position and position[:2]
+
+
+    def update(self, mmsi, lon, lat):
+        """
+        Sets the position of a vessel, moving it to its new cell if needed
+        """
+        if not (-180 * UNITS_PER_DEGREE <= lon <= 180 * UNITS_PER_DEGREE and
+                -90 * UNITS_PER_DEGREE <= lat <= 90 * UNITS_PER_DEGREE):
+            self.remove(mmsi)
+            return
+
+        cell = (lon // self.cell_size, lat // self.cell_size)
+        old = self._positions.get(mmsi)
+
+        if old is None or old[2] != cell:
+            if old is not None:
+                self._discard(mmsi, old[2])
+
+            members = self._cells.get(cell)
+
+            if members is None:
+                members = self._cells[cell] = set()
+
+            members.add(mmsi)
+
+        self._positions[mmsi] = (lon, lat, cell)
+
+
+    def remove(self, mmsi):
+        """
+        Removes a vessel from the index, if present
+        """
+        old = self._positions.pop(mmsi, None)
+
+        if old is not None:
+            self._discard(mmsi, old[2])
+
+
+    def _discard(self, mmsi, cell):
+        members = self._cells[cell]
+        members.discard(mmsi)
+
+        if not members:
+            del self._cells[cell]
+
+
+    def bbox(self, lon_min, lat_min, lon_max, lat_max):
+        """
+        Returns the list of (mmsi, lon, lat) of the vessels inside the bounding
+        box, bounds included. A box with lon_min > lon_max crosses the
+        antimeridian.
+        """
+        if lon_min > lon_max:
+            return self.bbox(lon_min, lat_min, 180 * UNITS_PER_DEGREE, lat_max) + \
+                   self.bbox(-180 * UNITS_PER_DEGREE, lat_min, lon_max, lat_max)
+
+        return [(mmsi, lon, lat) for mmsi, lon, lat in self._candidates(lon_min, lat_min, lon_max, lat_max)
+                if lon_min <= lon <= lon_max and lat_min <= lat <= lat_max]
+
+
+    def radius(self, lon, lat, meters):
+        """
+        Returns the list of (mmsi, lon, lat, distance) of the vessels within
+        the given distance in meters of a position, nearest first
+        """
+        result = []
+
+        for mmsi, vlon, vlat in self._around(lon, lat, meters):
+            d = distance(lon, lat, vlon, vlat)
+
+            if d <= meters:
+                result.append((mmsi, vlon, vlat, d))
+
+        result.sort(key = lambda r: r[3])
+
+        return result
+
+
+    def nearest(self, lon, lat, k = 1):
+        """
+        Returns the list of (mmsi, lon, lat, distance) of the k vessels nearest
+        to a position, nearest first. The search widens around the position
+        until no unvisited vessel can be nearer than the k found so far.
+        """
+        if k <= 0 or not self._positions:
+            return []
+
+        cell_m = self.cell_size / float(UNITS_PER_DEGREE) * math.pi / 180 * EARTH_RADIUS
+        meters = cell_m
+
+        while True:
+            found = self.radius(lon, lat, meters)
+
+            if len(found) >= k or len(found) == len(self._positions) or meters > math.pi * EARTH_RADIUS:
+                break
+
+            meters *= 4
+
+        if len(found) < k:
+            found = heapq.nsmallest(k, ((mmsi, vlon, vlat, distance(lon, lat, vlon, vlat))
+                                        for mmsi, (vlon, vlat, cell) in self._positions.items()),
+                                    key = lambda r: r[3])
+
+        return found[:k]
+
+
+    def _around(self, lon, lat, meters):
+        """
+        Yields the (mmsi, lon, lat) of the vessels in the cells overlapping the
+        box which bounds the circle of the given radius
+        """
+        dlat = int(meters / EARTH_RADIUS * 180 / math.pi * UNITS_PER_DEGREE) + 1
+        lat_min = max(lat - dlat, -90 * UNITS_PER_DEGREE)
+        lat_max = min(lat + dlat, 90 * UNITS_PER_DEGREE)
+
+        # Widest longitude span is at the latitude nearest to a pole
+        edge = max(abs(lat_min), abs(lat_max)) / float(UNITS_PER_DEGREE)
+        coslat = math.cos(math.radians(edge))
+
+        if lat_max >= 90 * UNITS_PER_DEGREE or lat_min <= -90 * UNITS_PER_DEGREE or \
+           dlat >= coslat * 180 * UNITS_PER_DEGREE:
+            spans = [(-180 * UNITS_PER_DEGREE, 180 * UNITS_PER_DEGREE)]
+        else:
+            dlon = int(dlat / coslat) + 1
+            lon_min, lon_max = lon - dlon, lon + dlon
+            spans = [(max(lon_min, -180 * UNITS_PER_DEGREE), min(lon_max, 180 * UNITS_PER_DEGREE))]
+
+            if lon_min < -180 * UNITS_PER_DEGREE:
+                spans.append((lon_min + 360 * UNITS_PER_DEGREE, 180 * UNITS_PER_DEGREE))
+            if lon_max > 180 * UNITS_PER_DEGREE:
+                spans.append((-180 * UNITS_PER_DEGREE, lon_max - 360 * UNITS_PER_DEGREE))
+
+        for lon_lo, lon_hi in spans:
+            for entry in self._candidates(lon_lo, lat_min, lon_hi, lat_max):
+                yield entry
+
+
+    def _candidates(self, lon_min, lat_min, lon_max, lat_max):
+        """
+        Yields the (mmsi, lon, lat) of the vessels in the cells overlapping the
+        box. When the box spans more cells than are occupied, the occupied
+        cells are scanned instead.
+        """
+        size = self.cell_size
+        x0, x1 = lon_min // size, lon_max // size
+        y0, y1 = lat_min // size, lat_max // size
+        positions = self._positions
+
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self._cells):
+            cells = [members for (x, y), members in self._cells.items()
+                     if x0 <= x <= x1 and y0 <= y <= y1]
+        else:
+            cells = [self._cells[(x, y)] for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)
+                     if (x, y) in self._cells]
+
+        for members in cells:
+            for mmsi in members:
+                position = positions[mmsi]
+                yield mmsi, position[0], position[1]
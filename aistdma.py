@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+
+"""
+SOTDMA and ITDMA communication state of AIS position reports.
+
+Builds and parses the 19-bit comm_state element of type 1, 2 and 3 position
+reports, and simulates the self organized slot reservations of many stations
+on the 2250 slot frame of a VHF data link, so simulated fleets send realistic
+communication states:
+
+    allocator = AISSlotAllocator()
+    station = AISStation(allocator)
+
+    aismsg.comm_state = station.transmit(t)
+
+This program is licensed under the GNU GENERAL PUBLIC LICENSE Version 2.
+A LICENSE file should have accompanied this program.
+"""
+
+import random
+import time
+
+
+# A frame lasts one minute and holds 2250 slots of 26.67 ms
+SLOTS_PER_FRAME = 2250
+FRAME_SECONDS = 60
+
+# Sync states
+SYNC_UTC_DIRECT = 0
+SYNC_UTC_INDIRECT = 1
+SYNC_BASE_STATION = 2
+SYNC_NUMBER_OF_STATIONS = 3
+
+
+def sotdma_comm_state(slot_timeout, sub_message, sync_state = SYNC_UTC_DIRECT):
+
+    """
+    Returns the 19-bit SOTDMA communication state of type 1 and 2 messages
+
+    @param  slot_timeout    Frames left before the slot is reallocated, 0-7
+    @param  sub_message     14-bit sub message, see sotdma_sub_message()
+    @param  sync_state      Synchronization state, 0-3
+    """
+
+    return ((sync_state & 0x3) << 17) | ((slot_timeout & 0x7) << 14) | (sub_message & 0x3fff)
+
+
+def sotdma_sub_message(slot_timeout, slot_number = 0, received_stations = 0,
+                       slot_offset = 0, hour = 0, minute = 0):
+
+    """
+    Returns the 14-bit SOTDMA sub message, whose meaning depends on the slot
+    time-out:
+
+        3, 5, 7     number of other stations received
+        2, 4, 6     slot number of this transmission
+        1           UTC hour and minute
+        0           offset to the slot of the next transmission
+    """
+
+    if slot_timeout in (3, 5, 7):
+        return received_stations & 0x3fff
+    if slot_timeout in (2, 4, 6):
+        return slot_number & 0x3fff
+    if slot_timeout == 1:
+        return ((hour & 0x1f) << 9) | ((minute & 0x7f) << 2)
+
+    return slot_offset & 0x3fff
+
+
+def itdma_comm_state(slot_increment, num_slots = 0, keep = 0, sync_state = SYNC_UTC_DIRECT):
+
+    """
+    Returns the 19-bit ITDMA communication state of type 3 messages
+
+    @param  slot_increment  Offset to the next allocated slot, 0-8191
+    @param  num_slots       Number of consecutive slots allocated, 0-7
+    @param  keep            1 to keep the slot allocated for one more frame
+    @param  sync_state      Synchronization state, 0-3
+    """
+
+    return ((sync_state & 0x3) << 17) | ((slot_increment & 0x1fff) << 4) | \
+           ((num_slots & 0x7) << 1) | (keep & 0x1)
+
+
+def parse_comm_state(msgid, comm_state):
+
+    """
+    Returns the fields of the communication state of a type 1, 2 or 3
+    message as a dict
+    """
+
+    state = {'sync_state': (comm_state >> 17) & 0x3}
+
+    if msgid == 3:
+        state['slot_increment'] = (comm_state >> 4) & 0x1fff
+        state['num_slots'] = (comm_state >> 1) & 0x7
+        state['keep'] = comm_state & 0x1
+        return state
+
+    timeout = (comm_state >> 14) & 0x7
+    sub = comm_state & 0x3fff
+    state['slot_timeout'] = timeout
+
+    if timeout in (3, 5, 7):
+        state['received_stations'] = sub
+    elif timeout in (2, 4, 6):
+        state['slot_number'] = sub
+    elif timeout == 1:
+        state['hour'] = sub >> 9
+        state['minute'] = (sub >> 2) & 0x7f
+    else:
+        state['slot_offset'] = sub
+
+    return state
+
+
+
+class AISSlotAllocator(object):
+
+    """
+    Reservations of the slots of one channel. The reserved slots are the set
+    bits of an integer, so the free slot nearest to a nominal slot is found
+    with a few big integer operations, whatever the number of stations.
+    Searches wrap around the end of the frame.
+    """
+
+    def __init__(self, slots = SLOTS_PER_FRAME):
+        self.slots = slots
+        self.stations = 0
+        self.overflows = 0
+        self._used = 0
+        self._count = 0
+        self._all = (1 << slots) - 1
+
+
+    def __len__(self):
+        """
+        Returns the number of reserved slots
+        """
+        return self._count
+
+
+    def reserved(self, slot):
+        return bool((self._used >> slot) & 1)
+
+
+    def reserve(self, slot):
+        """
+        Reserves the given slot, returns False if it was already reserved
+        """
+        if (self._used >> slot) & 1:
+            return False
+
+        self._used |= 1 << slot
+        self._count += 1
+
+        return True
+
+
+    def release(self, slot):
+        if (self._used >> slot) & 1:
+            self._used &= ~(1 << slot)
+            self._count -= 1
+
+
+    def allocate(self, nominal, width = None):
+        """
+        Reserves and returns the free slot nearest to the nominal slot, at
+        most width slots away, or None if there is none
+
+        @param  nominal     Nominal slot number
+        @param  width       Half width of the selection interval, defaults to
+                            the whole frame
+        """
+        n = self.slots
+
+        if width is None or width >= n // 2:
+            width = n // 2
+
+        # Free slots, repeated over three frames so the search around the
+        # nominal slot of the middle one does not wrap
+        free = self._all & ~self._used
+        free |= (free << n) | (free << (2 * n))
+        center = nominal % n + n
+
+        above = free >> center
+        up = (above & -above).bit_length() - 1 if above else None
+
+        below = free & ((1 << (center + 1)) - 1)
+        down = center - (below.bit_length() - 1) if below else None
+
+        if up is not None and up <= width and (down is None or up <= down):
+            slot = (center + up) % n
+        elif down is not None and down <= width:
+            slot = (center - down) % n
+        else:
+            self.overflows += 1
+            return None
+
+        self.reserve(slot)
+
+        return slot
+
+
+
+class AISStation(object):
+
+    """
+    SOTDMA slot reservations of one station. Each report is sent in a slot
+    chosen within the selection interval around its nominal slot, kept for
+    a random time-out of 3 to 7 frames, then moved to a new slot, as in
+    ITU-R M.1371. transmit() returns the communication state of each report.
+
+    When every slot of the selection interval is taken, the report is sent
+    in its nominal slot without a reservation, and the allocator counts an
+    overflow.
+    """
+
+    def __init__(self, allocator, rng = None):
+        self.allocator = allocator
+        self.slot = None
+        self._rng = rng or random.Random()
+
+        # nominal slot -> [slot, time-out, last frame used]
+        self._reservations = {}
+        self._frame = None
+
+        allocator.stations += 1
+
+
+    def transmit(self, t, interval = 10):
+        """
+        Returns the SOTDMA communication state of a report sent at time t, in
+        seconds since the epoch, and sets 'slot' to the slot used
+
+        @param  interval    Reporting interval in seconds, which sets the
+                            width of the selection interval
+        """
+        frame, offset = divmod(t, FRAME_SECONDS)
+        frame = int(frame)
+        slots = self.allocator.slots
+        nominal = int(round(offset * slots / FRAME_SECONDS)) % slots
+
+        # Selection interval, 20% of the nominal increment
+        width = max(1, int(slots * interval / FRAME_SECONDS / 10))
+
+        if frame != self._frame:
+            self._prune(frame)
+            self._frame = frame
+
+        reservation = self._reservations.get(nominal)
+
+        if reservation is None:
+            slot = self.allocator.allocate(nominal, width)
+
+            if slot is None:
+                self.slot = nominal
+                return sotdma_comm_state(0, 0)
+
+            reservation = self._reservations[nominal] = [slot, self._rng.randint(3, 7), frame]
+        elif reservation[2] != frame:
+            reservation[1] -= 1
+            reservation[2] = frame
+
+        slot, timeout = reservation[0], reservation[1]
+        self.slot = slot
+        offset = 0
+
+        if timeout == 0:
+            # Move to a new slot for the next frame
+            new = self.allocator.allocate(nominal, width)
+            self.allocator.release(slot)
+
+            if new is None:
+                del self._reservations[nominal]
+            else:
+                # Offset to the new slot, one frame later
+                shift = (new - slot) % slots
+                offset = slots + (shift - slots if shift > slots // 2 else shift)
+                self._reservations[nominal] = [new, self._rng.randint(3, 7) + 1, frame]
+
+        if timeout == 1:
+            utc = time.gmtime(t)
+            sub = sotdma_sub_message(1, hour = utc.tm_hour, minute = utc.tm_min)
+        else:
+            sub = sotdma_sub_message(timeout, slot_number = slot, slot_offset = offset,
+                                     received_stations = max(0, self.allocator.stations - 1))
+
+        return sotdma_comm_state(timeout, sub)
+
+
+    def release(self):
+        """
+        Releases all the slots of the station
+        """
+        for slot, timeout, frame in self._reservations.values():
+            self.allocator.release(slot)
+
+        self._reservations = {}
+        self.allocator.stations -= 1
+
+
+    def _prune(self, frame):
+        """
+        Releases the reservations not used in the previous frame, such as
+        after a change of reporting interval
+        """
+        stale = [nominal for nominal, r in self._reservations.items() if r[2] < frame - 1]
+
+        for nominal in stale:
+            self.allocator.release(self._reservations.pop(nominal)[0])
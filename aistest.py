@@ -1,6 +1,23 @@
 from __future__ import print_function
 
+import asyncio
+import csv
+import io
+import json
+import os
+import socket
+import pickle
+import random
+import tempfile
+
 import aislib
+import aisstore
+import aisserver
+import aisplay
+import aisbench
+import aisarchive
+import aisexport
+import aistdma
 
 #
 # Tests for Message Type 1
@@ -172,3 +189,745 @@ aismsg2 = ais.decode(payload)
 ais2 = aislib.AIS(aismsg2)
 payload2 = ais2.build_payload(False)
 assert payload == payload2
+
+#
+# Tests for the compiled message layouts
+#
+
+print('Tests for the compiled message layouts')
+
+aismsg = aislib.AISPositionReportMessage(mmsi=237772000, rot=-127, lon=-(70*60)*10000, lat=-(33*60)*10000)
+assert aismsg._layout.length == 168
+assert aismsg.build_bitstream().uint == aismsg.pack()
+values = aismsg._layout.unpack(aismsg.pack())
+assert values['rot'] == -127 and values['lon'] == -(70*60)*10000 and values['lat'] == -(33*60)*10000
+aismsg2 = aislib.AIS(aismsg).decode(aislib.AIS(aismsg).build_payload())
+assert aismsg2.get_attr('lon') == -(70*60)*10000 and aismsg2.get_attr('mmsi') == 237772000
+try:
+    aislib.AISPositionReportMessage(id=64)
+    assert False
+except ValueError:
+    pass
+
+#
+# Tests for the integer payload de-armoring
+#
+
+print('Tests for the integer payload de-armoring')
+
+assert aislib.dearmor('13RhLp801;QjL>0DD38:t?w@2D7k') == (aislib.AISPositionReportMessage(
+        mmsi=237772000, status=8, sog=75, pa=1, lon=(25*60+00)*10000, lat=(35*60+30)*10000,
+        cog=2800, ts=40, raim=1, comm_state=82419).pack(), 168)
+assert aislib.armor(*aislib.dearmor('w0', 2)) == 'w0,2'
+aismsg = aislib.AIS(aislib.AISPositionReportMessage()).decode('!AIVDM,1,1,,A,H3RhLp4T49I0000CFHIJ000`5110,0*64')
+assert isinstance(aismsg, aislib.AISStaticDataReportBMessage)
+try:
+    aislib.AIS(aismsg).decode('!AIVDM,1,1,,A,4000,0*00', ignore_crc=True)
+    assert False
+except aislib.UnsupportedMessageError:
+    pass
+
+#
+# Tests for the streaming decoder
+#
+
+print('Tests for the streaming decoder')
+
+lines = [
+    '!AIVDM,1,1,,A,13RhLp801;QjL>0DD38:t?w@2D7k,0*3E\n',
+    '\n',
+    '!AIVDM,1,1,,A,13RhLp801;QjL>0DD38:t?w@2D7k,0*00\n',
+    '!AIVDM,1,1,,A,H3RhLp0tJ1@PF0PTLR1<D5<00000,0*68\n',
+    '!AIVDM,1,1,,A,53RhLp000001=IQU`00tJ1@PF0PTLR1<D5<0000T0`5115GD?2Tm4SiPA1Dh00000000000,2*07\n'
+]
+ids = [m.get_attr('id') for m in aislib.decode_stream(lines, skip_invalid=True)]
+assert ids == [1, 24, 5]
+ids = [m.get_attr('id') for m in aislib.decode_stream(iter(lines), skip_invalid=True, types=(5,))]
+assert ids == [5]
+try:
+    list(aislib.decode_stream(lines))
+    assert False
+except aislib.CRCInvalidError:
+    pass
+
+#
+# Tests for multi-sentence reassembly
+#
+
+print('Tests for multi-sentence reassembly')
+
+fragments = [
+    '!AIVDM,2,1,1,A,55?MbV02;H;s<HtKR20EHE:0@T4@Dn2222222216L961O5Gf0NSQEp6ClRp8,0*1C',
+    '!AIVDM,2,2,1,A,88888888880,2*25'
+]
+reassembler = aislib.AISReassembler()
+assert reassembler.add(fragments[0]) is None and len(reassembler) == 1
+aismsg = reassembler.add(fragments[1])
+assert aismsg.get_attr('id') == 5 and aismsg.get_attr('mmsi') == 351759000
+assert len(reassembler) == 0 and reassembler.dropped == 0
+assert reassembler.add(fragments[1]) is None and reassembler.dropped == 1
+try:
+    aislib.decode(fragments[0])
+    assert False
+except aislib.FragmentError:
+    pass
+ids = [m.get_attr('mmsi') for m in aislib.decode_stream(fragments + lines[:1], types=(5,))]
+assert ids == [351759000]
+
+now = [0]
+reassembler = aislib.AISReassembler(max_pending=2, timeout=10, clock=lambda: now[0])
+for seq in '123':
+    reassembler.add(fragments[0].replace(',1,A,', ',%s,A,' % seq), ignore_crc=True)
+assert len(reassembler) == 2 and reassembler.dropped == 1
+now[0] = 11
+assert reassembler.add(fragments[1], ignore_crc=True) is None
+assert len(reassembler) == 0 and reassembler.dropped == 4
+
+#
+# Tests for multi-sentence encoding
+#
+
+print('Tests for multi-sentence encoding')
+
+aismsg = aislib.AISStaticAndVoyageReportMessage(mmsi=237772000, callsign='SVXYZ',
+         shipname='OF THE HIGH SEAS', shiptype=36, destination='STROFADES', dte=1)
+bits = aismsg.pack()
+sentences = aislib.AIS(aismsg).build_sentences(seq_id=3)
+print(sentences)
+assert len(sentences) == 2 and all(len(s) <= 80 for s in sentences)
+assert sentences[0].startswith('!AIVDM,2,1,3,A,') and sentences[1].startswith('!AIVDM,2,2,3,A,')
+assert [m.pack() for m in aislib.decode_stream(sentences)] == [bits]
+sentences = aislib.AIS(aislib.AISPositionReportMessage(mmsi=237772000)).build_sentences()
+assert len(sentences) == 1 and sentences[0].startswith('!AIVDM,1,1,,A,')
+
+#
+# Tests for decoding files
+#
+
+print('Tests for decoding files')
+
+fd, path = tempfile.mkstemp(suffix='.nmea')
+with os.fdopen(fd, 'w') as f:
+    for mmsi in range(200):
+        f.write(aislib.AIS(aislib.AISPositionReportMessage(mmsi=mmsi)).build_payload() + '\n')
+        f.write('\n'.join(aislib.AIS(aislib.AISStaticAndVoyageReportMessage(mmsi=mmsi)).build_sentences()) + '\n')
+try:
+    ranges = aislib._split_file(path, 1000)
+    assert len(ranges) > 1 and ranges[-1][1] == os.path.getsize(path)
+    aismsgs = list(aislib.decode_file(path, workers=1, chunk_size=1000))
+    assert [m.get_attr('mmsi') for m in aismsgs] == [mmsi for mmsi in range(200) for _ in (1, 5)]
+    assert [m.get_attr('id') for m in aismsgs[:2]] == [1, 5]
+    # Fragments interleaved with other sentences, as merged feeds send them
+    with open(path, 'w') as f:
+        for mmsi in range(200):
+            first, second = aislib.AIS(aislib.AISStaticAndVoyageReportMessage(mmsi=mmsi)).build_sentences()
+            f.write('\n'.join([first, aislib.AIS(aislib.AISPositionReportMessage(mmsi=mmsi)).build_payload(),
+                               second]) + '\n')
+    for chunk_size in (100, 1000, 1234):
+        aismsgs = list(aislib.decode_file(path, workers=1, chunk_size=chunk_size))
+        assert [m.mmsi for m in aismsgs] == [mmsi for mmsi in range(200) for _ in (1, 5)]
+finally:
+    os.remove(path)
+
+aismsg = pickle.loads(pickle.dumps(aismsgs[0]))
+assert type(aismsg) is aislib.AISPositionReportMessage and aismsg.pack() == aismsgs[0].pack()
+
+#
+# Tests for lazy and header-only decoding
+#
+
+print('Tests for lazy and header-only decoding')
+
+payload = '!AIVDM,1,1,,A,13RhLp801;QjL>0DD38:t?w@2D7k,0*3E'
+assert aislib.decode_header(payload) == (1, 0, 237772000)
+assert aislib.payload_header('H3RhLp4T49I0000CFHIJ000`5110') == (24, 0, 237772000)
+aismsg = aislib.decode(payload, lazy=True)
+assert aismsg.get_attr('mmsi') == 237772000 and type(aismsg) is not aislib.AISPositionReportMessage
+assert aismsg.get_attr('lat') == (35*60+30)*10000 and type(aismsg) is aislib.AISPositionReportMessage
+aismsg = aislib.decode(payload, lazy=True)
+aismsg.sog = 80
+assert aismsg.get_attr('sog') == 80 and aismsg.get_attr('cog') == 2800
+assert aislib.AIS(aislib.decode(payload, lazy=True)).build_payload() == payload
+aismsg = aislib.decode('!AIVDM,1,1,,A,H3RhLp4T49I0000CFHIJ000`5110,0*64', lazy=True)
+assert isinstance(aismsg, aislib.AISStaticDataReportBMessage) and aismsg.get_attr('to_bow') == 5
+
+#
+# Tests for per-instance message storage
+#
+
+print('Tests for per-instance message storage')
+
+aismsgs = list(aislib.decode_stream(lines, skip_invalid=True))
+assert [m.id for m in aismsgs] == [1, 24, 5] and aismsgs[0].mmsi == 237772000
+aismsg = aislib.AISPositionReportMessage(mmsi=1)
+aismsg2 = aislib.AISPositionReportMessage(mmsi=2)
+assert aismsg.mmsi == 1 and aismsg2.get_attr('mmsi') == 2 and not hasattr(aismsg, '__dict__')
+aismsg.sog = 123
+assert aislib.decode(aislib.AIS(aismsg).build_payload()).sog == 123
+try:
+    aismsg.unknown = 1
+    assert False
+except AttributeError:
+    pass
+for name, value, error in [('sog', 5000, ValueError), ('mmsi', 2**30 + 5, ValueError),
+                           ('lon', 1.5, TypeError)]:
+    setattr(aismsg, name, value)
+    try:
+        aislib.AIS(aismsg).build_payload()
+        assert False
+    except error:
+        pass
+    setattr(aismsg, name, 0)
+
+#
+# Tests for columnar decoding of position reports
+#
+
+if aislib.numpy is not None:
+    print('Tests for columnar decoding of position reports')
+
+    aismsgs = [aislib.AISPositionReportMessage(id=1 + i % 3, mmsi=237772000 + i, status=i % 16, rot=-i,
+               sog=10 * i, lon=-(25*60)*10000 - i, lat=(35*60)*10000 + i, cog=i, heading=i,
+               ts=i % 60, raim=i % 2) for i in range(100)]
+    sentences = [aislib.AIS(m).build_payload() for m in aismsgs]
+    sentences[7] = sentences[7][:-2] + '00'
+    sentences.insert(3, '!AIVDM,1,1,,A,H3RhLp4T49I0000CFHIJ000`5110,0*64')
+    positions = aislib.decode_positions(sentences)
+    expected = [m for i, m in enumerate(aismsgs) if i != 7]
+    assert len(positions) == len(expected)
+    for row, m in zip(positions, expected):
+        assert tuple(int(v) for v in row) == tuple(getattr(m, name) for name, _ in aislib.position_dtype)
+    assert len(aislib.decode_positions(sentences, ignore_crc=True)) == 100
+    for garbage in ('garbage' + sentences[0][6:], sentences[0][:-3] + ' 3E', sentences[0] + '0',
+                    sentences[0].replace('!AIVDM', '!AIVDMX')):
+        assert len(aislib.decode_positions([garbage], ignore_crc=True)) == 0
+    assert len(aislib.decode_positions(['$' + sentences[0][1:]], ignore_crc=True)) == 1
+
+#
+# Tests for bulk encoding of position reports
+#
+
+if aislib.numpy is not None:
+    print('Tests for bulk encoding of position reports')
+
+    sentences = [aislib.AIS(m).build_payload() for m in aismsgs]
+    assert aislib.encode_positions(
+        id=[m.id for m in aismsgs], mmsi=[m.mmsi for m in aismsgs], status=[m.status for m in aismsgs],
+        rot=[m.rot for m in aismsgs], sog=[m.sog for m in aismsgs], lon=[m.lon for m in aismsgs],
+        lat=[m.lat for m in aismsgs], cog=[m.cog for m in aismsgs], heading=[m.heading for m in aismsgs],
+        ts=[m.ts for m in aismsgs], raim=[m.raim for m in aismsgs]) == sentences
+    assert aislib.encode_positions(aislib.decode_positions(sentences)) == sentences
+    sentence, = aislib.encode_positions(mmsi=237772000, channel='B')
+    assert sentence.startswith('!AIVDM,1,1,,B,') and aislib.decode(sentence).mmsi == 237772000
+    try:
+        aislib.encode_positions(mmsi=[1, 2], sog=[0, 1024])
+        assert False
+    except ValueError:
+        pass
+    for column in ([1.9], aislib.numpy.array([1.0]), [True]):
+        try:
+            aislib.encode_positions(lat=column)
+            assert False
+        except TypeError:
+            pass
+    assert aislib.encode_positions(mmsi=aislib.numpy.array([1], dtype=aislib.numpy.uint64)) == \
+           [aislib.AIS(aislib.AISPositionReportMessage(mmsi=1)).build_payload()]
+
+#
+# Tests for the sentence tokenizer
+#
+
+print('Tests for the sentence tokenizer')
+
+sentence = aislib.tokenize('!AIVDM,2,1,1,A,55?MbV02;H;s<HtKR20EHE:0@T4@Dn2222222216L961O5Gf0NSQEp6ClRp8,0*1C\r\n')
+assert sentence == ('AI', 'VDM', 2, 1, '1', 'A', '55?MbV02;H;s<HtKR20EHE:0@T4@Dn2222222216L961O5Gf0NSQEp6ClRp8', 0)
+assert aislib.tokenize('!AIVDM,1,1,,A,13RhLp801;QjL>0DD38:t?w@2D7k,0*3E').payload == '13RhLp801;QjL>0DD38:t?w@2D7k'
+for line in ('', '!AIVDM,1,1,,A,13RhLp801;QjL>0DD38:t?w@2D7k,0', '!AIVDM,1,1,A,13RhLp801;QjL>0DD38:t?w@2D7k,0*3E',
+             'AIVDM,1,1,,A,13RhLp801;QjL>0DD38:t?w@2D7k,0*3E'):
+    try:
+        aislib.tokenize(line)
+        assert False
+    except ValueError:
+        pass
+try:
+    aislib.tokenize('!AIVDM,1,1,,A,13RhLp801;QjL>0DD38:t?w@2D7k,0*3F')
+    assert False
+except aislib.CRCInvalidError:
+    pass
+assert aislib.crc('!AIVDM,1,1,,A,13RhLp801;QjL>0DD38:t?w@2D7k,0*3E') == 0x3E
+
+#
+# Tests for the vessel store
+#
+
+print('Tests for the vessel store')
+
+now = [0]
+store = aisstore.VesselStore(max_vessels=2, max_age=100, clock=lambda: now[0])
+position = aislib.decode('!AIVDM,1,1,,A,13RhLp801;QjL>0DD38:t?w@2D7k,0*3E')
+record = store.update(position)
+assert record.mmsi == 237772000 and record.position is position and record.static_b is None
+static_b = aislib.decode('!AIVDM,1,1,,A,H3RhLp4T49I0000CFHIJ000`5110,0*64', lazy=True)
+assert store.update(static_b) is record and record.static_b is static_b and len(store) == 1
+assert store.update(aislib.AISAtonReport(mmsi=992659995)) is None
+now[0] = 50
+store.update(aislib.AISPositionReportMessage(mmsi=1))
+store.update(aislib.AISPositionReportMessage(mmsi=237772000))
+store.update(aislib.AISPositionReportMessage(mmsi=2))
+assert 1 not in store and store.get(237772000) is record and store.evicted == 1
+now[0] = 160
+assert store.expire() == 2 and len(store) == 0
+
+#
+# Tests for the spatial index
+#
+
+print('Tests for the spatial index')
+
+U = aisstore.UNITS_PER_DEGREE
+index = aisstore.SpatialIndex()
+index.update(1, 25*U, 35*U)
+index.update(2, 25*U + 600, 35*U)          # ~90 m east
+index.update(3, 26*U, 35*U)
+index.update(4, 180*U, 0)
+index.update(5, -180*U + 600, 0)
+index.update(6, 181*60*10000, 91*60*10000)  # not available
+assert len(index) == 5 and 6 not in index
+assert sorted(m for m, lon, lat in index.bbox(24*U, 34*U, 25*U + 1000, 36*U)) == [1, 2]
+assert sorted(m for m, lon, lat in index.bbox(179*U, -1*U, -179*U, 1*U)) == [4, 5]
+assert [r[0] for r in index.radius(25*U, 35*U, 1000)] == [1, 2]
+assert [r[0] for r in index.radius(180*U, 0, 1000)] == [4, 5]
+assert [r[0] for r in index.nearest(26*U - 600, 35*U, 2)] == [3, 2]
+index.update(2, 30*U, 30*U)
+index.remove(3)
+assert [r[0] for r in index.radius(25*U, 35*U, 200000)] == [1]
+
+store = aisstore.VesselStore(max_vessels=1, index=aisstore.SpatialIndex())
+store.update(aislib.AISPositionReportMessage(mmsi=7, lon=25*U, lat=35*U))
+assert store.index.get(7) == (25*U, 35*U)
+store.update(aislib.AISPositionReportMessage(mmsi=8, lon=25*U, lat=35*U))
+assert 7 not in store.index and 8 in store.index
+
+#
+# Tests for the static sentence cache
+#
+
+print('Tests for the static sentence cache')
+
+assert aislib.AISString2Int('SVXYZ', 7) == aislib.AISString2Bits('SVXYZ', 7).int
+assert aislib.AISString2Int('OF THE HIGH SEAS', 20) == aislib.AISString2Bits('OF THE HIGH SEAS', 20).int
+cache = aislib.AISSentenceCache(maxsize=2)
+voyage = dict(mmsi=237772000, callsign='SVXYZ', shipname='OF THE HIGH SEAS', destination='STROFADES')
+for seq_id in (4, 4, 9):
+    assert cache.build(aislib.AISStaticAndVoyageReportMessage, seq_id=seq_id, **voyage) == \
+           aislib.AIS(aislib.AISStaticAndVoyageReportMessage(**voyage)).build_sentences(seq_id=seq_id)
+assert cache.hits == 2 and cache.misses == 1
+aton = dict(mmsi=992659995, aid_type=28, name='MEASUREMENT BUOY', lon=10769643, lat=37578551)
+assert cache.build(aislib.AISAtonReport, channel='B', **aton) == \
+       aislib.AIS(aislib.AISAtonReport(**aton)).build_sentences(channel='B')
+cache.build(aislib.AISStaticDataReportAMessage, mmsi=237772000, shipname='OF THE HIGH SEAS')
+assert len(cache) == 2
+cache.build(aislib.AISStaticAndVoyageReportMessage, seq_id=4, **voyage)
+assert cache.misses == 4
+
+#
+# Tests for prepared messages
+#
+
+print('Tests for prepared messages')
+
+prepared = aislib.AISPreparedMessage(aislib.AISPositionReportMessage(mmsi=237772000, status=0, raim=1), channel='B')
+for i in range(50):
+    fields = dict(lon=(-1) ** i * i * 12345, lat=i * 6789, sog=i * 3 % 1023, cog=i * 71 % 3600,
+                  heading=i * 7 % 360, ts=i % 60, comm_state=i * 1001)
+    if i % 3:
+        del fields['sog']
+    sentence = prepared.build(**fields)
+    assert sentence == aislib.AIS(prepared.message()).build_sentences(channel='B')[0]
+    assert int(sentence[-2:], 16) == aislib.crc(sentence)
+    assert aislib.decode(sentence).lon == fields['lon']
+    assert aislib.decode(sentence).mmsi == 237772000
+assert prepared.build() == sentence
+for fields, error in [(dict(sog=1024), ValueError), (dict(lat=-2**26 - 1), ValueError),
+                      (dict(cog=1.0), TypeError)]:
+    try:
+        prepared.build(**fields)
+        assert False
+    except error:
+        pass
+assert prepared.build() == sentence
+try:
+    aislib.AISPreparedMessage(aislib.AISStaticAndVoyageReportMessage())
+    assert False
+except ValueError:
+    pass
+
+#
+# Tests for the asyncio ingest
+#
+
+print('Tests for the asyncio ingest')
+
+async def ingest_feeds():
+    ingest = aisserver.AISIngest(maxsize=1, batch_size=2)
+    udp = await ingest.serve_udp('127.0.0.1', 0)
+    tcp = await ingest.serve_tcp('127.0.0.1', 0)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.sendto(''.join(lines).encode('latin-1'), udp.get_extra_info('sockname'))
+    reader, writer = await asyncio.open_connection(*tcp.sockets[0].getsockname())
+    writer.write((fragments[0] + '\r\n').encode('latin-1'))
+    await writer.drain()
+    writer.write((fragments[1] + '\n' + lines[0]).encode('latin-1'))
+    writer.close()
+
+    received = []
+    async for aismsg in ingest.messages():
+        received.append(aismsg.get_attr('mmsi'))
+        if len(received) == 5:
+            break
+    sock.close()
+    ingest.close()
+    return ingest, received
+
+ingest, received = asyncio.run(ingest_feeds())
+assert sorted(received) == [237772000, 237772000, 237772000, 237772000, 351759000]
+assert ingest.received == 7 and ingest.invalid == 1 and ingest.decoded == 5 and ingest.dropped == 0
+
+async def ingest_backpressure():
+    ingest = aisserver.AISIngest(maxsize=1, batch_size=1)
+    ingest.feed(lines[:1])
+    ingest.feed(lines[:1])
+    ingest.feed(lines[:1])
+    assert ingest.queue.full() and ingest._blocked is not None and ingest.dropped == 1
+    add, ingest.reassembler.add = ingest.reassembler.add, None
+    ingest.feed(lines[:2] + lines[3:])
+    ingest.reassembler.add = add
+    assert ingest.dropped == 4 and ingest.received == 6
+    assert len(await ingest.queue.get()) == 1
+    await asyncio.sleep(0)
+    assert ingest.queue.full() and ingest._blocked is None
+    ingest.close()
+
+asyncio.run(ingest_backpressure())
+
+#
+# Tests for track playback
+#
+
+print('Tests for track playback')
+
+assert [aisplay.report_interval(sog) for sog in (0, 14, 20, 30)] == [10, 10, 6, 2]
+assert aisplay.report_interval(0, 1) == 180
+track = aisplay.load_track('highspeed4.txt', 239658000, static=['!static'])
+assert len(track.points) == 254 and track.points[0] == (1441259100, 25.14329, 35.34297, 0.0, 256.0)
+lon, lat, sog, cog = track.position(1441259100 + 660)
+assert abs(lat - 35.342975) < 1e-9 and sog == 0.0
+other = aisplay.AISTrack(237772000, [(1441259100, 25.0, 35.0, 20.0, 90.0), (1441259130, 25.1, 35.0, 20.0, 90.0)])
+playback = aisplay.AISPlayback(itu_intervals=True)
+playback.add(track)
+playback.add(other)
+events = list(playback.events(until=1441259130))
+assert [t - 1441259100 for t, s in events] == [0, 0, 0, 6, 10, 12, 18, 20, 24, 30, 30]
+assert events[0][1] == '!static' and len(playback) == 2
+aismsg = aislib.decode(events[3][1])
+assert aismsg.mmsi == 237772000 and aismsg.lon == 15012000 and aismsg.sog == 200 and aismsg.ts == 6
+playback = aisplay.AISPlayback(speed=1e6)
+playback.add(track)
+sentences = []
+asyncio.run(playback.play(sentences.append))
+assert len([s for s in sentences if s != "!static"]) == 253  # one timestamp is repeated
+assert aislib.decode(sentences[-1]).mmsi == 239658000
+
+#
+# Tests for the benchmarks
+#
+
+print('Tests for the benchmarks')
+
+report = aisbench.run(count=20, repeat=1)
+assert len(report['results']) == 18
+assert all(r['messages_per_second'] > 0 for r in report['results'])
+assert [r[4] for r in aisbench.compare(report, report)] == [0.0] * 18
+for name, aisclass, fixed in aisbench.corpora[1:]:
+    messages = aisbench.generate(aisclass, fixed, 10)
+    decoded = [m for m in aisbench.roundtrip(messages) if m is not None]
+    assert [m.pack() for m in decoded] == [m.pack() for m in messages]
+    assert all(type(m) is aisclass for m in decoded)
+
+#
+# Tests for the instrumentation
+#
+
+print('Tests for the instrumentation')
+
+assert aislib.stats is None
+stats = aislib.enable_stats()
+assert aislib.enable_stats() is stats
+aislib.decode(lines[0])
+list(aislib.decode_stream(lines + fragments, skip_invalid=True))
+for msg in (lines[2], fragments[0], '!AIVDM,1,1,,A,13RhLp801;QjL>0DD38:t?w@2D7k,0*3E,', '!AIVDM,1,1,,A,D3RhLp0,0*67'):
+    try:
+        aislib.decode(msg)
+        assert False
+    except Exception:
+        pass
+aislib.AIS(aislib.decode(lines[0])).build_payload()
+snapshot = stats.snapshot()
+assert snapshot['messages'] == {'decode': {1: 3, 24: 1, 5: 2}, 'build': {1: 1}, 'encode': {1: 1}}
+assert snapshot['errors'] == {'crc': 2, 'unsupported': 1, 'fragment': 1, 'malformed': 1}
+assert snapshot['latency']['decode']['count'] == 7 and snapshot['latency']['decode']['buckets'][-1] == (float('inf'), 7)
+text = stats.prometheus()
+assert 'aislib_messages_total{operation="decode",type="5"} 2\n' in text
+assert 'aislib_errors_total{error="crc"} 2\n' in text
+assert 'aislib_latency_seconds_bucket{operation="build",le="+Inf"} 1\n' in text
+reassembler = aislib.AISReassembler()
+assert list(aislib.decode_stream([fragments[1], fragments[1]], reassembler=reassembler)) == []
+assert reassembler.dropped == 2 and stats.snapshot()['errors']['fragment'] == 3
+assert aislib.disable_stats() is stats and aislib.stats is None
+aislib.decode(lines[0])
+assert stats.snapshot()['latency']['decode']['count'] == 9
+
+#
+# Tests for the binary archive
+#
+
+print('Tests for the binary archive')
+
+path = os.path.join(tempfile.mkdtemp(), 'feed.ais')
+messages = list(aislib.decode_stream(lines + fragments, skip_invalid=True))
+with aisarchive.AISArchiveWriter(path) as writer:
+    for i, aismsg in enumerate(messages):
+        writer.write(aismsg, received=1000.0 - i)
+with aisarchive.AISArchiveWriter(path, payload_bytes=21) as writer:
+    assert writer.payload_bytes == 53
+    writer.write(messages[0], received=2000.0)
+assert os.path.getsize(path) == 16 + 5 * 68
+with aisarchive.AISArchive(path) as archive:
+    assert len(archive) == 5
+    assert [(t, m.pack()) for t, m in archive] == [(1000.0 - i, m.pack()) for i, m in enumerate(messages)] + [(2000.0, messages[0].pack())]
+    assert [type(m) for t, m in archive][1:3] == [aislib.AISStaticDataReportAMessage, aislib.AISStaticAndVoyageReportMessage]
+    assert [t for t, m in archive.query(mmsi=237772000)] == [998.0, 999.0, 1000.0, 2000.0]
+    assert [t for t, m in archive.query(mmsi=237772000, start=999.0, end=2000.0)] == [999.0, 1000.0]
+    assert [m.mmsi for t, m in archive.query(start=997.0, end=998.0)] == [351759000]
+    assert [t for t, m in archive.query(types=(5,))] == [997.0, 998.0]
+    decode_bits, decoded = aislib.decode_bits, []
+    aislib.decode_bits = lambda value, length: decoded.append(length) or decode_bits(value, length)
+    try:
+        assert [m.id for t, m in archive.query(types={1})] == [1, 1] and len(decoded) == 2
+    finally:
+        aislib.decode_bits = decode_bits
+    assert list(archive.query(mmsi=1)) == [] and archive.mmsis() == {237772000, 351759000}
+    assert archive[-1][0] == 2000.0
+    headers = archive.headers()
+    assert next(headers) == (1000.0, 1, 237772000)
+archive.close()
+small = os.path.join(os.path.dirname(path), 'positions.ais')
+with aisarchive.AISArchiveWriter(small, payload_bytes=21) as writer:
+    writer.write(messages[0], received=0)
+    try:
+        writer.write(messages[2])
+        assert False
+    except ValueError:
+        pass
+assert os.path.getsize(small) == 16 + 36
+try:
+    aisarchive.AISArchive(__file__)
+    assert False
+except ValueError:
+    pass
+
+#
+# Tests for duplicate suppression
+#
+
+print('Tests for duplicate suppression')
+
+now = [0.0]
+dedup = aislib.AISDeduplicator(window=30, buckets=3, clock=lambda: now[0])
+assert not dedup.seen('13RhLp801;QjL>0DD38:t?w@2D7k') and dedup.seen('13RhLp801;QjL>0DD38:t?w@2D7k')
+assert not dedup.seen('13RhLp801;QjL>0DD38:t?w@2D7k', 2)
+now[0] = 25.0
+assert dedup.seen('13RhLp801;QjL>0DD38:t?w@2D7k') and dedup.duplicates == 2
+now[0] = 31.0
+assert not dedup.seen('13RhLp801;QjL>0DD38:t?w@2D7k') and len(dedup) == 1
+small = aislib.AISDeduplicator(max_size=2, clock=lambda: now[0])
+for i, t in enumerate((0.0, 10.0, 20.0)):
+    now[0] = t
+    small.seen(str(i))
+assert len(small) == 2 and not small.seen('0') and small.seen('2')
+now[0] = 0.0
+small = aislib.AISDeduplicator(max_size=10, clock=lambda: now[0])
+for i in range(1000):
+    assert not small.seen(str(i))
+assert len(small) <= 10 and small.seen('999')
+try:
+    aislib.AISDeduplicator(max_size=0)
+    assert False
+except ValueError:
+    pass
+assert not aislib.AISDeduplicator(max_size=1).seen('x', now=0.0)
+late = aislib.AISDeduplicator(window=10, buckets=2)
+assert not late.seen('a', now=100.0) and not late.seen('b', now=50.0)
+assert not late.seen('b', now=101.0) and late.seen('b', now=102.0)
+assert not late.seen('c', now=96.0) and late.seen('c', now=97.0) and len(late) == 3
+assert not late.seen('c', now=110.0) and len(late) == 1
+now[0] = 0.0
+reassembler = aislib.AISReassembler(dedup=aislib.AISDeduplicator(clock=lambda: now[0]))
+merged = [lines[0], lines[0], fragments[0], fragments[0].replace(',A,', ',B,')[:-2] + '1F',
+          fragments[1], fragments[1].replace(',A,', ',B,')[:-2] + '26', lines[0]]
+assert aislib.crc(merged[3]) == 0x1F and aislib.crc(merged[5]) == 0x26
+decoded = [m.mmsi for m in aislib.decode_stream(merged, reassembler=reassembler)]
+assert decoded == [237772000, 351759000] and reassembler.dedup.duplicates == 3
+
+#
+# Tests for filters
+#
+
+print('Tests for filters')
+
+where = aislib.AISFilter(types=(1, 5), mmsi=range(237000000, 238000000))
+assert where.match(lines[0]) and not where.match(lines[3]) and not where.match(fragments[0])
+assert where.match(fragments[1]) and where.match('garbage')
+assert not aislib.AISFilter(channels='B').match(lines[0])
+assert aislib.decode(lines[0], where=where).mmsi == 237772000
+assert aislib.decode(lines[3], where=where) is None
+assert aislib.decode(lines[2], where=aislib.AISFilter(types=(5,))) is None  # not checksummed
+ids = [m.id for m in aislib.decode_stream(lines + fragments, skip_invalid=True, where=where)]
+assert ids == [1, 5]
+ids = [m.id for m in aislib.decode_stream(lines + fragments, skip_invalid=True, types=(5, 24), where=where)]
+assert ids == [5]
+reassembler = aislib.AISReassembler()
+feed = (lines[:1] + fragments) * 3 + fragments[1:]
+ids = [m.id for m in aislib.decode_stream(feed, types=(1,), reassembler=reassembler)]
+assert ids == [1, 1, 1] and reassembler.dropped == 1 and len(reassembler) == 0
+reassembler = aislib.AISReassembler()
+assert reassembler.skip(lines[0]) is None and len(reassembler) == 0
+reassembler.skip(fragments[0].encode('ascii'))
+assert len(reassembler) == 1 and reassembler.add(fragments[0]) is None and reassembler.dropped == 0
+ids = [m.mmsi for m in aislib.decode_stream(lines + fragments, where=aislib.AISFilter(mmsi={351759000}))]
+assert ids == [351759000]
+
+async def ingest_filtered():
+    ingest = aisserver.AISIngest(where=aislib.AISFilter(types=(24,)))
+    ingest.feed(lines + fragments)
+    return ingest, await ingest.queue.get()
+
+ingest, batch = asyncio.run(ingest_filtered())
+assert [m.id for m in batch] == [24] and ingest.invalid == 0
+
+#
+# Tests for bytes input
+#
+
+print('Tests for bytes input')
+
+for convert in (bytes, bytearray, lambda b: memoryview(b'xx' + b + b'yy')[2:-2]):
+    raw = convert(lines[0].encode('ascii'))
+    assert aislib.decode(raw).pack() == aislib.decode(lines[0]).pack()
+    assert aislib.crc(raw) == aislib.crc(lines[0]) == 0x3E
+    assert aislib.tokenize(raw) == aislib.tokenize(lines[0])
+    assert aislib.AISFilter(types=(1,), channels='A').match(raw)
+    assert not aislib.AISFilter(types=(5,)).match(raw)
+    assert not aislib.AISFilter(mmsi={1}).match(raw)
+    assert aislib.dearmor(convert(b'13RhLp')) == aislib.dearmor('13RhLp')
+try:
+    aislib.decode(lines[2].encode('ascii'))
+    assert False
+except aislib.CRCInvalidError:
+    pass
+try:
+    aislib.decode(b'!AIVDM,1,1,,A,13RhLp801;QjL>0DD38:t?w@2D7k,0')
+    assert False
+except ValueError:
+    pass
+raw = [l.encode('ascii') for l in lines + fragments]
+assert [m.mmsi for m in aislib.decode_stream(raw, skip_invalid=True)] == \
+       [m.mmsi for m in aislib.decode_stream(lines + fragments, skip_invalid=True)]
+assert [m.mmsi for m in aislib.decode_stream(raw, types=(5,), skip_invalid=True)] == [237772000, 351759000]
+assert [m.mmsi for m in aislib.decode_stream(map(memoryview, raw), skip_invalid=True)] == \
+       [m.mmsi for m in aislib.decode_stream(raw, skip_invalid=True)]
+
+async def ingest_memoryview():
+    ingest = aisserver.AISIngest()
+    ingest.feed([memoryview(l + b'\r\n') for l in raw])
+    return ingest, await ingest.queue.get()
+
+ingest, batch = asyncio.run(ingest_memoryview())
+assert [m.mmsi for m in batch] == [m.mmsi for m in aislib.decode_stream(raw, skip_invalid=True)]
+if aislib.numpy is not None:
+    assert (aislib.decode_positions(raw) == aislib.decode_positions(lines)).all()
+
+#
+# Tests for exporting
+#
+
+print('Tests for exporting')
+
+voyage = aislib.AISStaticAndVoyageReportMessage(mmsi=237772000, callsign='SVXYZ', shipname='OF "THE", HIGH SEAS')
+assert voyage.as_tuple()[:3] == (5, 0, 237772000)
+assert voyage.as_dict()['callsign'] == aislib.AISString2Int('SVXYZ', 7)
+assert voyage.as_dict(text=True)['shipname'] == 'OF "THE", HIGH SEAS'
+assert aislib.AISInt2String(aislib.AISString2Int('ABC', 3), 3) == 'ABC'
+messages = list(aislib.decode_stream(lines + fragments, skip_invalid=True, lazy=True)) + [voyage]
+f = io.StringIO()
+assert aisexport.write_jsonl(messages, f, batch_size=2) == 5
+rows = [json.loads(line) for line in f.getvalue().splitlines()]
+assert rows == [m.as_dict(text=True) for m in messages]
+assert rows[4]['shipname'] == 'OF "THE", HIGH SEAS'
+f = io.StringIO()
+assert aisexport.write_csv(messages, f, batch_size=2) == 5
+rows = list(csv.reader(io.StringIO(f.getvalue())))
+columns = aisexport.csv_columns()
+assert rows[0] == columns and len(rows) == 6 and columns[:3] == ['id', 'repeat', 'mmsi']
+assert rows[5][columns.index('shipname')] == 'OF "THE", HIGH SEAS' and rows[1][columns.index('shipname')] == ''
+assert rows[1][columns.index('lon')] == str(messages[0].lon)
+f = io.StringIO()
+aisexport.write_csv(messages, f, columns=['mmsi'], header=False)
+assert f.getvalue().split() == [str(m.mmsi) for m in messages]
+
+#
+# Tests for communication states
+#
+
+print('Tests for communication states')
+
+assert aistdma.sotdma_comm_state(5, aistdma.sotdma_sub_message(5, received_stations=499)) == 82419
+assert aistdma.parse_comm_state(1, 82419) == {'sync_state': 0, 'slot_timeout': 5, 'received_stations': 499}
+assert aistdma.parse_comm_state(1, aistdma.sotdma_comm_state(1, aistdma.sotdma_sub_message(1, hour=13, minute=45))) == \
+       {'sync_state': 0, 'slot_timeout': 1, 'hour': 13, 'minute': 45}
+assert aistdma.parse_comm_state(2, aistdma.sotdma_comm_state(4, aistdma.sotdma_sub_message(4, slot_number=2249), 3)) == \
+       {'sync_state': 3, 'slot_timeout': 4, 'slot_number': 2249}
+assert aistdma.parse_comm_state(3, aistdma.itdma_comm_state(8191, 7, 1, 1)) == \
+       {'sync_state': 1, 'slot_increment': 8191, 'num_slots': 7, 'keep': 1}
+
+slots = aistdma.AISSlotAllocator(slots=10)
+assert slots.allocate(5) == 5 and slots.allocate(5) == 6 and slots.allocate(5) == 4
+assert slots.allocate(9) == 9 and slots.allocate(9) == 0 and slots.allocate(5, 1) is None
+assert slots.allocate(5) == 7 and len(slots) == 6 and slots.overflows == 1
+slots.release(6)
+assert not slots.reserved(6) and slots.allocate(5, 1) == 6
+
+slots = aistdma.AISSlotAllocator()
+stations = [aistdma.AISStation(slots, random.Random(i)) for i in range(300)]
+used = set()
+for k in range(30):
+    for i, station in enumerate(stations):
+        t = 1441259100.0 + k * 10 + i * (10.0 / 300)
+        state = aistdma.parse_comm_state(1, station.transmit(t))
+        assert (int(t // 60), station.slot) not in used
+        used.add((int(t // 60), station.slot))
+        if state['slot_timeout'] in (2, 4, 6):
+            assert state['slot_number'] == station.slot
+        elif state['slot_timeout'] == 0:
+            assert 2250 - 38 <= state['slot_offset'] <= 2250 + 38
+assert len(slots) == 1800 and slots.overflows == 0
+stations[0].release()
+assert len(slots) == 1794 and slots.stations == 299
+
+playback = aisplay.AISPlayback(itu_intervals=True, slots=aistdma.AISSlotAllocator())
+playback.add(aisplay.AISTrack(237772000, [(1441259100, 25.0, 35.0, 20.0, 90.0), (1441259400, 25.1, 35.0, 20.0, 90.0)]))
+states = [aistdma.parse_comm_state(1, aislib.decode(s).comm_state) for t, s in playback.events()]
+assert len(states) == 51 and states[0]['slot_timeout'] in (3, 4, 5, 6, 7)
+timeouts = [s['slot_timeout'] for s in states[::10]]  # same nominal slot, one frame apart
+assert timeouts[:timeouts[0] + 1] == list(range(timeouts[0], -1, -1))[:len(timeouts)]